@@ -1,55 +1,120 @@
-from flask import Flask, redirect, url_for, flash, render_template, jsonify, request
+from flask import Flask, Response, g, redirect, url_for, flash, render_template, request, stream_with_context
 from flask_login import login_required, logout_user, current_user
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 from .config import Config
-from .models import db, login_manager, User, Token, Event, EventCategory, Category, Attendance, Comment, UserInterest, Interest
+from .models import db, comment_author_options, login_manager, forget_token, token_cache, DataVersion, User, Token, Event, EventCategory, Category, Attendance, Comment, UserInterest, Interest
 from .oauth import blueprint
-from .cli import create_db
+from .internal import blueprint as internal_blueprint, register_stats, register_metrics
+from .instrumentation import Instrumentation, log, log_event
+from .cli import create_db, seed, reconcile_counts, send_mail, check_indexes, bench_passwords, bench, bench_serialize, bench_json_encoding, bench_upstream_latency, bench_rate_limiter, bench_idle_streams
+from .mailer import enqueue_email
+from .cache import ResponseCache, make_cache
+from .recommend import RecommendationIndex
+from .search import TextIndex, search_events
+from .ratelimit import RateLimiter, make_buckets, json_account
+from .passwords import HashingBusy
+from .pubsub import make_broker
+from .routing import ReplicaRouter, use_primary
+from .encoding import jsonify, dumps, compress_response, compress, compressible, encoded_response, preferred_encoding
+from .geocoding import GeocodingCache
+from .geo import covering_cells, prefix_range, haversine_km, KM_PER_DEGREE
+from .serializers import Serializer
+from .pagination import keyset, decode_cursor, next_cursor, parse_limit
 from flask_migrate import Migrate
 from flask_cors import CORS
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 import googlemaps
+import threading
 import uuid, os
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from prettyprinter import pprint
-import requests
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config.from_object(Config)
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 app.register_blueprint(blueprint, url_prefix="/login")
+app.register_blueprint(internal_blueprint, url_prefix="/internal")
 app.cli.add_command(create_db)
+app.cli.add_command(seed)
+app.cli.add_command(reconcile_counts)
+app.cli.add_command(send_mail)
+app.cli.add_command(check_indexes)
+app.cli.add_command(bench_passwords)
+app.cli.add_command(bench)
+app.cli.add_command(bench_serialize)
+app.cli.add_command(bench_json_encoding)
+app.cli.add_command(bench_upstream_latency)
+app.cli.add_command(bench_rate_limiter)
+app.cli.add_command(bench_idle_streams)
 db.init_app(app)
 login_manager.init_app(app)
 migrate = Migrate(app, db)
 CORS(app)
-gmaps = googlemaps.Client(key=os.environ.get('GOOGLE_KEY'))
+instrumentation = Instrumentation(app)
+register_metrics(instrumentation.metrics)
+app.after_request(compress_response)
+gmaps = GeocodingCache(lambda: googlemaps.Client(
+    key=os.environ.get('GOOGLE_KEY'), timeout=app.config['GEOCODE_TIMEOUT']),
+                       maxsize=app.config['GEOCODE_CACHE_SIZE'],
+                       ttl=app.config['GEOCODE_CACHE_TTL'],
+                       grid=app.config['GEOCODE_GRID_DECIMALS'])
+response_cache = ResponseCache(
+    make_cache(app.config['CACHE_URL'],
+               maxsize=app.config['CACHE_SIZE'],
+               ttl=app.config['CACHE_TTL'],
+               decode=False))
+ReplicaRouter(db,
+              current_user,
+              sticky_seconds=app.config['REPLICA_STICKY_SECONDS']).init_app(app)
+recommender = RecommendationIndex(max_age=app.config['RECOMMENDATION_INDEX_TTL'])
+search_index = TextIndex(max_age=app.config['SEARCH_INDEX_TTL'])
+limiter = RateLimiter(
+    make_buckets(app.config['RATELIMIT_URL'],
+                 maxsize=app.config['RATELIMIT_MEMORY_SIZE']))
+register_stats('geocode', gmaps.stats)
+register_stats('response_cache', response_cache.backend.stats)
+broker = make_broker(app.config['PUBSUB_URL'],
+                     queue_size=app.config['SSE_QUEUE_SIZE'])
+stream_slots = threading.BoundedSemaphore(app.config['SSE_MAX_STREAMS'])
+if app.config['PUBSUB_URL']:
+    token_cache.share(broker)
+register_stats('ratelimit', limiter.stats)
+register_stats('pubsub', broker.stats)
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    res = {'success': False, 'message': 'Server busy, please try again'}
+    response = jsonify(res)
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def current_account():
+    if current_user.is_authenticated:
+        return current_user.get_id()
+    return None
 
 
 def send_email(token, email, name):
-    url = 'https://api.mailgun.net/v3/sandboxd25ec24b7b1d4277aaeac6b2622859f5.mailgun.org/messages'
-    try:
-        response = requests.post(
-            url,
-            auth=("api", app.config['EMAIL_API']),
-            data={
-                "from":
-                'Ricardo <fitoskalante@gmail.com>',
-                "to": [email],
-                "subject":
-                "Reset Password",
-                "text":
-                f"To reset your password click on this link https://localhost:3000/set-new-pw/{token}."
-            })
-        response.raise_for_status()
-    except Exception as err:
-        print(f'Other error occurred: {err}')
-    else:
-        res = {"success": False, "message": "This email is not registered"}
-        return jsonify(res)
+    enqueue_email(
+        email, "Reset Password",
+        f"To reset your password click on this link https://localhost:3000/set-new-pw/{token}."
+    )
+    db.session.commit()
 
 
 @app.route('/recover', methods=['GET', 'POST'])
+@limiter.limit('auth', account=json_account('email'))
 def recover_password():
     if request.method == 'POST':
         email = request.get_json()
@@ -95,6 +160,7 @@ def set_new_pw(token):
 def logout():
     token = Token.query.filter_by(user_id=current_user.id).first()
     if token:
+        forget_token(token.uuid)
         db.session.delete(token)
         db.session.commit()
     logout_user()
@@ -110,15 +176,24 @@ def index():
 @app.route('/getuser')
 @login_required
 def getuser():
-    return jsonify({
+    # the token the request came with; a session login (Facebook) need not
+    # have one
+    token = g.get('api_token')
+    if token is None:
+        tokens = current_user.token
+        token = tokens[0].uuid if tokens else None
+    response = jsonify({
         'id': current_user.id,
         'name': current_user.name,
         'email': current_user.email,
-        'token': current_user.token[0].uuid
+        'token': token
     })
+    response.add_etag(weak=True)
+    return private(response.make_conditional(request))
 
 
 @app.route('/register', methods=['POST'])
+@limiter.limit('auth', account=json_account('email'))
 def register():
     if request.method == 'POST':
         data = request.get_json()
@@ -132,7 +207,16 @@ def register():
                 country=data['country'],
             )
             user.set_password(data['password'])
-            user.add()
+            try:
+                user.add()
+            except IntegrityError:
+                # a concurrent submit with the same email won the insert
+                db.session.rollback()
+                res = {
+                    'success': False,
+                    "message": "This email is already registered"
+                }
+                return jsonify(res)
             res = {
                 'success': True,
                 "message": "Success",
@@ -149,18 +233,130 @@ def get_events_by_location():
     if request.method == 'POST':
         data = request.get_json()
         city = data.split(', ')[0]
-        evs_city = Event.query.filter_by(city=city).all()
+        evs_city = Event.with_details().filter_by(city=city).all()
+        Event.load_latest_comments(evs_city)
+        serializer = Serializer()
         if len(evs_city) > 0:
             res = {
                 'success': True,
                 'message': 'Join these Tribes in',
-                'events': [i.convert_to_obj() for i in evs_city]
+                'events': [i.convert_to_obj(serializer) for i in evs_city]
             }
             return jsonify(res)
         res = {'success': False, 'message': 'No Tribes yet in'}
         return jsonify(res)
 
 
+MAX_RADIUS_KM = 500
+
+
+@app.route('/geteventsnearby')
+def get_events_nearby():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = min(float(request.args.get('radius', 10)), MAX_RADIUS_KM)
+    except (KeyError, ValueError):
+        res = {'success': False, 'message': 'lat and lng are required'}
+        return jsonify(res)
+    limit = parse_limit(request.args.get('limit'))
+
+    query = Event.query.options(
+        load_only('id', 'creator_id', 'title', 'city', 'country', 'date',
+                  'image_url', 'lat', 'lng'))
+    cells = covering_cells(lat, lng, radius)
+    if cells:
+        ranges = []
+        for cell in cells:
+            lower, upper = prefix_range(cell)
+            cond = Event.geohash >= lower
+            if upper:
+                cond = and_(cond, Event.geohash < upper)
+            ranges.append(cond)
+        query = query.filter(or_(*ranges))
+    dlat = radius / KM_PER_DEGREE
+    query = query.filter(Event.lat.between(lat - dlat, lat + dlat))
+
+    nearby = []
+    for e in query:
+        distance = haversine_km(lat, lng, e.lat, e.lng)
+        if distance <= radius:
+            nearby.append((distance, e))
+    nearby.sort(key=lambda pair: (pair[0], pair[1].id))
+
+    events = []
+    for distance, e in nearby[:limit]:
+        ev = e.event_info()
+        ev['position'] = {'lat': e.lat, 'lng': e.lng}
+        ev['distance'] = round(distance, 3)
+        events.append(ev)
+    res = {'success': True, 'events': events}
+    return jsonify(res)
+
+
+@app.route('/recommendations')
+@login_required
+def recommendations():
+    limit = parse_limit(request.args.get('limit'))
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+    except (KeyError, ValueError):
+        lat = lng = None
+    interests = [i.name for i in current_user.interests]
+    scored = recommender.recommend(current_user.id,
+                                   interests,
+                                   current_user.city,
+                                   lat=lat,
+                                   lng=lng,
+                                   limit=limit)
+    ids = [event_id for _, event_id in scored]
+    found = {e.id: e for e in Event.query.filter(Event.id.in_(ids))}
+    events = []
+    for score, event_id in scored:
+        if event_id in found:
+            ev = found[event_id].event_info()
+            ev['score'] = round(score, 3)
+            events.append(ev)
+    res = {'success': True, 'events': events}
+    return jsonify(res)
+
+
+@app.route('/search')
+def search():
+    q = request.args.get('q', '')
+    try:
+        category = request.args.get('category', type=int)
+        date_from = parse_date(request.args.get('from'))
+        date_to = parse_date(request.args.get('to'))
+        if date_to:
+            # 'to' names a whole day
+            date_to += timedelta(days=1)
+    except ValueError:
+        res = {'success': False, 'message': 'Invalid search filters'}
+        return jsonify(res)
+    results = search_events(q,
+                            parse_limit(request.args.get('limit')),
+                            search_index,
+                            city=request.args.get('city'),
+                            category=category,
+                            date_from=date_from,
+                            date_to=date_to)
+    events = []
+    for e, rank in results:
+        ev = e.event_info()
+        ev['rank'] = round(float(rank), 4)
+        events.append(ev)
+    res = {'success': True, 'events': events}
+    return jsonify(res)
+
+
+def parse_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
 @app.route('/addaboutyou', methods=['POST'])
 def add_about_you():
     if request.method == 'POST':
@@ -171,13 +367,8 @@ def add_about_you():
         user = User.query.get(user_id)
 
         user.description = description
+        UserInterest.link(user_id, interests)
         db.session.commit()
-
-        if len(interests) > 0:
-            for interest in interests:
-                usin = UserInterest(user_id=user_id, interest_id=interest)
-                db.session.add(usin)
-                db.session.commit()
         res = {
             'success': True,
             "message": "Success",
@@ -186,6 +377,7 @@ def add_about_you():
 
 
 @app.route('/login', methods=['POST'])
+@limiter.limit('auth', account=json_account('email'))
 def login():
     if request.method == 'POST':
         data = request.get_json()
@@ -199,6 +391,9 @@ def login():
                 "message": "Wrong Password, please try again"
             }
             return jsonify(res)
+        if user in db.session.dirty:
+            # check_password upgraded the stored hash
+            db.session.commit()
         token = Token.query.filter_by(user_id=user.id).first()
         if not token:
             token = Token(uuid=str(uuid.uuid4().hex), user_id=user.id)
@@ -215,6 +410,7 @@ def login():
 
 
 @app.route('/getpos', methods=['POST'])
+@limiter.limit('geocode', account=current_account)
 def geocode():
     if request.method == 'POST':
         address = request.get_json()
@@ -235,6 +431,7 @@ def geocode():
 
 
 @app.route('/getaddress', methods=['POST'])
+@limiter.limit('geocode', account=current_account)
 def reverse_geocode():
     if request.method == 'POST':
         latlng = request.get_json()
@@ -245,7 +442,6 @@ def reverse_geocode():
                 'city': reverse_geocode_result[6],
                 'address': reverse_geocode_result[0]
             }
-            print(res)
             if not res:
                 res_two = {
                     'city': reverse_geocode_result[2],
@@ -270,24 +466,73 @@ def reverse_geocode():
             return jsonify(res)
 
 
+MAX_RSVP_BATCH = 100
+
+
+def parse_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# applies {event_id: attending} for one user in a single transaction and
+# returns the ids of existing events, those whose RSVP actually changed and
+# the resulting attendance counts
+def apply_rsvps(user_id, wanted):
+    if not wanted:
+        return set(), {}, {}
+    known = {
+        id
+        for (id, ) in db.session.query(Event.id).filter(
+            Event.id.in_(list(wanted)))
+    }
+    changed = {}
+    for event_id in sorted(known):
+        attending = wanted[event_id]
+        if attending and Attendance.join(event_id, user_id):
+            Event.bump(event_id, attendance=1)
+            changed[event_id] = True
+        elif not attending and Attendance.leave(event_id, user_id):
+            Event.bump(event_id, attendance=-1)
+            changed[event_id] = False
+    db.session.commit()
+    counts = attendance_counts(known)
+    for event_id, attending in changed.items():
+        if attending:
+            recommender.on_join(event_id, user_id)
+        else:
+            recommender.on_leave(event_id, user_id)
+        publish_update(event_id, {
+            'type': 'attendance',
+            'user_id': user_id,
+            'attending': attending,
+            'attendance': counts.get(event_id)
+        })
+    return known, changed, counts
+
+
+def attendance_counts(event_ids):
+    return dict(
+        db.session.query(Event.id, Event.attendance_count).filter(
+            Event.id.in_(list(event_ids))))
+
+
 @app.route('/joinevent', methods=['POST'])
 def join_event():
     if request.method == 'POST':
-        api_key = request.headers.get('Authorization')
-        if api_key:
-            api_key = api_key.replace('Token ', '', 1)
-            token = Token.query.filter_by(uuid=api_key).first()
-            if token:
-                currentuser = token.user
-                if currentuser:
-                    ev_id = request.get_json()
-                    a = Attendance(event_id=ev_id, user_id=currentuser.id)
-                    db.session.add(a)
-                    db.session.commit()
-                    get_all_a = len(
-                        Attendance.query.filter_by(event_id=ev_id).all())
-                    res = {'joined': True, 'attendance': get_all_a}
-                    return jsonify(res)
+        if current_user.is_authenticated:
+            ev_id = parse_event_id(request.get_json())
+            known, changed, counts = apply_rsvps(current_user.id,
+                                                 {ev_id: True})
+            if not known:
+                res = {'success': False, 'message': 'Event not found'}
+                return jsonify(res)
+            res = {
+                'joined': True,
+                'attendance': counts.get(ev_id)
+            }
+            return jsonify(res)
         res = {'notloged': True}
         return jsonify(res)
 
@@ -296,16 +541,61 @@ def join_event():
 @login_required
 def leave_event():
     if request.method == 'POST':
-        ev_id = request.get_json()
-        a = Attendance.query.filter_by(event_id=ev_id,
-                                       user_id=current_user.id).first()
-        print('isjcisudnciwdsjcniwsc', a, current_user.id)
-        db.session.delete(a)
-        db.session.commit()
+        ev_id = parse_event_id(request.get_json())
+        known, changed, counts = apply_rsvps(current_user.id, {ev_id: False})
+        log_event('leave_event',
+                  event_id=ev_id,
+                  user_id=current_user.id,
+                  attending=ev_id in changed)
         res = {'joined': False}
         return jsonify(res)
 
 
+# Syncs many RSVP changes in one request:
+# {"rsvps": [{"event_id": 1, "attending": true}, ...]}. Every change is
+# idempotent, so a client can resend the whole batch after a dropped
+# response; for repeated ids the last entry wins.
+@app.route('/rsvp', methods=['POST'])
+@login_required
+def rsvp():
+    data = request.get_json(silent=True) or {}
+    rsvps = data.get('rsvps') if isinstance(data, dict) else None
+    if not isinstance(rsvps, list) or len(rsvps) > MAX_RSVP_BATCH:
+        res = {
+            'success': False,
+            'message': 'Send up to {} rsvps'.format(MAX_RSVP_BATCH)
+        }
+        return jsonify(res)
+    wanted = {}
+    for item in rsvps:
+        if not isinstance(item, dict):
+            item = {}
+        ev_id = parse_event_id(item.get('event_id'))
+        attending = item.get('attending')
+        # a JSON boolean only: "false" or 0 must not read as a join
+        if ev_id is None or not isinstance(attending, bool):
+            res = {'success': False, 'message': 'Invalid rsvp entry'}
+            return jsonify(res)
+        wanted[ev_id] = attending
+    known, changed, counts = apply_rsvps(current_user.id, wanted)
+    results = [{
+        'event_id': ev_id,
+        'attending': wanted[ev_id],
+        'changed': ev_id in changed,
+        'attendance': counts.get(ev_id),
+    } for ev_id in wanted if ev_id in known]
+    log_event('rsvp',
+              user_id=current_user.id,
+              joined=sum(1 for v in changed.values() if v),
+              left=sum(1 for v in changed.values() if not v))
+    res = {
+        'success': True,
+        'results': results,
+        'unknown': sorted(set(wanted) - known)
+    }
+    return jsonify(res)
+
+
 @app.route('/comment', methods=['POST'])
 @login_required
 def comment():
@@ -314,66 +604,351 @@ def comment():
         c = Comment(body=response['comment'],
                     user_id=current_user.id,
                     event_id=response['id'])
+        Event.bump(response['id'], comments=1)
         c.add()
+        search_index.add_comment(int(response['id']), c.body)
         comment = Comment.query.filter_by(id=c.id).first()
-        print(comment)
+        log_event('comment', comment_id=c.id, event_id=response['id'])
         if comment:
+            publish_update(comment.event_id, {
+                'type': 'comment',
+                'comment': Serializer().comment(comment)
+            })
             res = {'success': True}
             return jsonify(res)
         res = {'success': False}
         return jsonify(res)
 
 
-@app.route('/geteventlist')
-def get_event_list():
-    event_list = Event.query.all()
-    res = [i.convert_to_obj() for i in event_list]
-    return jsonify(res)
+STREAM_BATCH_SIZE = 100
+
+
+def parse_fields(value):
+    if not value:
+        return None
+    if value == 'summary':
+        return Event.summary_fields
+    return frozenset(f.strip() for f in value.split(',') if f.strip())
+
+
+def event_list_query(fields):
+    if fields is None or not fields <= Event.scalar_fields:
+        return Event.with_details()
+    columns = fields | {'id', 'date'}
+    return Event.query.options(load_only(*columns))
+
+
+def preload_comments(events, fields):
+    if fields is None or not fields <= Event.scalar_fields:
+        Event.load_latest_comments(events)
+
+
+def serialize_event(e, fields, serializer):
+    if fields is None:
+        return e.convert_to_obj(serializer)
+    return e.project(fields, serializer)
+
+
+def stream_event_list(query, fields, cursor):
+    def generate():
+        page_cursor = cursor
+        sep = ''
+        yield '['
+        while True:
+            serializer = Serializer()
+            page = keyset(query, Event.date, Event.id, page_cursor,
+                          STREAM_BATCH_SIZE).all()
+            preload_comments(page, fields)
+            for e in page:
+                yield sep + dumps(serialize_event(e, fields, serializer))
+                sep = ','
+            if len(page) < STREAM_BATCH_SIZE:
+                break
+            page_cursor = (page[-1].date, page[-1].id)
+            db.session.expunge_all()
+        yield ']'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+def json_response(body):
+    return app.response_class(body, mimetype='application/json')
+
+
+# the body cached under key at version, or dumps(build()) on a miss; the
+# compressed variant the client accepts is cached next to it, so a hit
+# neither queries nor compresses
+def cached_json(key, version, build):
+    encoding = preferred_encoding()
+    if encoding:
+        data = response_cache.get_encoded(key, version, encoding)
+        if data is not None:
+            return encoded_response(data, encoding)
+    body = response_cache.get(key, version)
+    if body is None:
+        # a lagging replica must not seed the shared cache with old data
+        use_primary()
+        body = dumps(build())
+        response_cache.set(key, version, body)
+    data = body.encode()
+    if not encoding or not compressible(len(data)):
+        # compress_response still adds Vary when it applies
+        return json_response(data)
+    data = compress(data, encoding)
+    response_cache.set_encoded(key, version, encoding, data)
+    return encoded_response(data, encoding)
+
+
+def build_event_list(args, fields, cursor):
+    serializer = Serializer()
+    if not any(k in args for k in ('cursor', 'limit', 'fields')):
+        event_list = Event.with_details().all()
+        Event.load_latest_comments(event_list)
+        return [i.convert_to_obj(serializer) for i in event_list]
+    limit = parse_limit(args.get('limit'))
+    page = keyset(event_list_query(fields), Event.date, Event.id, cursor,
+                  limit).all()
+    preload_comments(page, fields)
+    return {
+        'success': True,
+        'events': [serialize_event(e, fields, serializer) for e in page],
+        'next_cursor': next_cursor(page, 'date', limit),
+    }
+
+
+# Validators come from Event.updated_at for one event and from the
+# 'events' DataVersion for lists, which every edit, RSVP and comment moves
+# forward, so a revalidation costs one primary-key lookup and a match
+# returns before anything is loaded or serialized.
+def validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def not_modified(etag, last_modified):
+    if is_resource_modified(request.environ,
+                            etag=etag,
+                            last_modified=last_modified):
+        return None
+    return validators(app.response_class(status=304), etag, last_modified)
+
 
+# bodies that depend on the token may only be cached by the client itself
+def private(response):
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
 
+
+def version_tag(*parts):
+    return '-'.join(
+        p.isoformat() if isinstance(p, datetime) else str(p)
+        for p in parts)
+
+
+@app.route('/geteventlist')
+def get_event_list():
+    args = request.args
+    fields = parse_fields(args.get('fields'))
+    cursor = decode_cursor(args.get('cursor'))
+    if args.get('cursor') and not cursor:
+        res = {'success': False, 'message': 'Invalid cursor'}
+        return jsonify(res)
+    # no Last-Modified: no timestamp orders list changes by commit
+    etag = version_tag('events', DataVersion.current('events'))
+    unchanged = not_modified(etag, None)
+    if unchanged:
+        return unchanged
+    if args.get('stream'):
+        return validators(
+            stream_event_list(event_list_query(fields), fields, cursor),
+            etag, None)
+
+    # keyed on the same version as the ETag, so every worker serves the
+    # body that matches the validators it sends
+    variant = urlencode(sorted(args.items(multi=True)))
+    response = cached_json(response_cache.list_key(variant), etag,
+                           lambda: build_event_list(args, fields, cursor))
+    return validators(response, etag, None)
+
+
+# the event's updated_at, or None when there is no such event
+def event_version(id):
+    version = db.session.query(Event.updated_at).filter_by(id=id).scalar()
+    if version is None:
+        # possibly created moments ago and not on the replica yet
+        use_primary()
+        version = db.session.query(Event.updated_at).filter_by(id=id).scalar()
+    return version
+
+
+# the shared event body is cached; per-user flags are layered on top
 @app.route('/geteventinfo/<id>')
 def get_event_info(id):
-    e = Event.query.filter_by(id=id).first()
-    api_key = request.headers.get('Authorization')
-    if api_key:
-        api_key = api_key.replace('Token ', '', 1)
-        token = Token.query.filter_by(uuid=api_key).first()
-        if token:
-            currentuser = token.user
-            if currentuser:
-                check_attending = Attendance.query.filter_by(
-                    event_id=id, user_id=currentuser.id).first()
-                print(check_attending)
-                if check_attending:
-                    if e.creator_id == currentuser.id:
-                        res = {
-                            'event': e.convert_to_obj(),
-                            'attending': True,
-                            'user_loged': True,
-                            'my_event': True,
-                        }
-                        return jsonify(res)
-                    res = {
-                        'event': e.convert_to_obj(),
-                        'attending': True,
-                        'user_loged': True,
-                        'my_event': False,
-                    }
-                    return jsonify(res)
-                res = {
-                    'event': e.convert_to_obj(),
-                    'attending': False,
-                    'user_loged': True,
-                    'my_event': False,
-                }
-                return jsonify(res)
-    res = {
-        'event': e.convert_to_obj(),
-        'attending': False,
-        'user_loged': False,
-        'my_event': False,
-    }
-    return jsonify(res)
+    last_modified = event_version(id)
+    if last_modified is None:
+        res = {'success': False, 'message': 'Event not found'}
+        return jsonify(res)
+    # the per-user flags only change through RSVPs and edits, which move
+    # updated_at, so the user id completes the validator
+    etag = version_tag('event', id, last_modified, current_user.get_id())
+    unchanged = not_modified(etag, last_modified)
+    if unchanged:
+        return private(unchanged)
+    key = response_cache.event_key(id)
+    version = version_tag(last_modified)
+    event = response_cache.get(key, version)
+    if event is None:
+        use_primary()
+        e = Event.with_details().filter_by(id=id).first()
+        if not e:
+            res = {'success': False, 'message': 'Event not found'}
+            return jsonify(res)
+        event = dumps(e.convert_to_obj())
+        response_cache.set(key, version, event)
+
+    res = {'attending': False, 'user_loged': False, 'my_event': False}
+    if current_user.is_authenticated:
+        res['user_loged'] = True
+        check_attending = Attendance.query.filter_by(
+            event_id=id, user_id=current_user.id).first()
+        if check_attending:
+            res['attending'] = True
+            creator_id = db.session.query(
+                Event.creator_id).filter_by(id=id).scalar()
+            res['my_event'] = creator_id == current_user.id
+    response = json_response('{"event":' + event + ',' + dumps(res)[1:])
+    return private(validators(response, etag, last_modified))
+
+
+# newest first, paged on (created_at, id); every comment moves the event's
+# updated_at, which keys the cached pages and their validators
+@app.route('/events/<int:id>/comments')
+def event_comments(id):
+    cursor = decode_cursor(request.args.get('cursor'))
+    if request.args.get('cursor') and not cursor:
+        res = {'success': False, 'message': 'Invalid cursor'}
+        return jsonify(res)
+    limit = parse_limit(request.args.get('limit'))
+    last_modified = event_version(id)
+    if last_modified is None:
+        res = {'success': False, 'message': 'Event not found'}
+        return jsonify(res)
+    etag = version_tag('comments', id, last_modified,
+                       request.args.get('cursor', ''), limit)
+    unchanged = not_modified(etag, last_modified)
+    if unchanged:
+        return unchanged
+    key = '{}:comments:{}:{}'.format(
+        response_cache.event_key(id),
+        request.args.get('cursor', ''), limit)
+
+    def build():
+        query = Comment.query.filter_by(event_id=id).options(
+            *comment_author_options())
+        page = keyset(query,
+                      Comment.created_at,
+                      Comment.id,
+                      cursor,
+                      limit,
+                      descending=True).all()
+        serializer = Serializer()
+        return {
+            'success': True,
+            'comments': [serializer.comment(c) for c in page],
+            'next_cursor': next_cursor(page, 'created_at', limit),
+        }
+
+    response = cached_json(key, version_tag(last_modified), build)
+    return validators(response, etag, last_modified)
+
+
+EDITABLE_FIELDS = frozenset([
+    'title', 'description', 'image_url', 'address', 'city', 'country', 'time',
+    'date', 'lat', 'lng'
+])
+
+
+def publish_update(event_id, delta):
+    delta['event_id'] = event_id
+    try:
+        broker.publish('event:{}'.format(event_id), dumps(delta, compact=True))
+    except Exception:
+        # the write is committed; live subscribers will resync on reconnect
+        log.warning("publishing event update failed", exc_info=True)
+
+
+# Server-Sent Events: a snapshot of the counters, then one JSON delta per
+# comment, RSVP change or edit. A subscriber that falls too far behind gets
+# {"type": "resync"} and the stream ends, so the client refetches and
+# reconnects. Each worker serves at most SSE_MAX_STREAMS at once and
+# answers 503 beyond that, so the client polls instead; serve many of them
+# with GUNICORN_WORKER_CLASS=gevent.
+@app.route('/events/<int:id>/stream')
+def event_stream(id):
+    if not stream_slots.acquire(blocking=False):
+        res = {
+            'success': False,
+            'message': 'Too many live streams, poll instead'
+        }
+        response = jsonify(res)
+        response.status_code = 503
+        response.headers['Retry-After'] = str(
+            max(1, app.config['SSE_RETRY_MS'] // 1000))
+        return response
+    # subscribe before reading the snapshot so no update falls in between
+    subscription = broker.subscribe('event:{}'.format(id))
+
+    def close():
+        broker.unsubscribe(subscription)
+        stream_slots.release()
+
+    try:
+        counts = db.session.query(Event.attendance_count,
+                                  Event.comment_count).filter_by(id=id).first()
+    except Exception:
+        close()
+        raise
+    if counts is None:
+        close()
+        res = {'success': False, 'message': 'Event not found'}
+        return jsonify(res)
+    snapshot = dumps(
+        {
+            'type': 'snapshot',
+            'event_id': id,
+            'attendance': counts[0],
+            'comments': counts[1]
+        },
+        compact=True)
+    heartbeat = app.config['SSE_HEARTBEAT']
+
+    def generate():
+        yield 'retry: {}\n\ndata: {}\n\n'.format(app.config['SSE_RETRY_MS'],
+                                                 snapshot)
+        while True:
+            message = subscription.get(heartbeat)
+            if subscription.overflowed:
+                yield 'data: {"type":"resync"}\n\n'
+                return
+            if message is None:
+                yield ': keepalive\n\n'
+            else:
+                yield 'data: ' + message + '\n\n'
+
+    response = Response(generate(),
+                        mimetype='text/event-stream',
+                        headers={
+                            'Cache-Control': 'no-cache',
+                            'X-Accel-Buffering': 'no'
+                        })
+    # runs when the server closes the response, even if the client left
+    # before the generator started
+    response.call_on_close(close)
+    return response
 
 
 @app.route('/create-event', methods=['POST'])
@@ -381,7 +956,6 @@ def get_event_info(id):
 def create_event():
     if request.method == 'POST':
         ev_info = request.get_json()
-        print(ev_info)
         e = Event(
             title=ev_info['title'],
             creator_id=current_user.id,
@@ -394,16 +968,20 @@ def create_event():
             date=ev_info['startDate'],
             lat=ev_info['pos']['lat'],
             lng=ev_info['pos']['lng'],
+            attendance_count=1,
         )
-        e.add()
-        a = Attendance(event_id=e.id, user_id=current_user.id)
-        a.add()
-        categories = ev_info['categories']
-        if len(categories) > 0:
-            for category in categories:
-                evcat = EventCategory(event_id=e.id, category_id=category)
-                db.session.add(evcat)
-                db.session.commit()
+        db.session.add(e)
+        db.session.flush()
+        db.session.add(Attendance(event_id=e.id, user_id=current_user.id))
+        EventCategory.link(e.id, ev_info['categories'])
+        db.session.commit()
+        recommender.refresh_event(e.id)
+        recommender.on_join(e.id, current_user.id)
+        search_index.refresh_event(e.id)
+        log_event('create_event',
+                  event_id=e.id,
+                  user_id=current_user.id,
+                  categories=ev_info['categories'])
         res = {"success": True, "event_id": e.id}
         return jsonify(res)
 
@@ -413,32 +991,26 @@ def create_event():
 def edit_event():
     if request.method == 'POST':
         ev_info = request.get_json()
-
-        old_categs = EventCategory.query.filter_by(
-            event_id=ev_info['id']).all()
-        for c in old_categs:
-            db.session.delete(c)
-            db.session.commit()
         e = Event.query.get(ev_info['id'])
-        e.title = ev_info['title'],
-        e.creator_id = current_user.id,
-        e.description = ev_info['description'],
-        e.image_url = ev_info['image'],
-        e.address = ev_info['address'],
-        e.city = ev_info['city'],
-        e.country = ev_info['country'],
-        e.time = ev_info['startTime'],
-        e.date = ev_info['startDate'],
-        e.lat = ev_info['pos']['lat'],
-        e.lng = ev_info['pos']['lng'],
-
+        e.title = ev_info['title']
+        e.creator_id = current_user.id
+        e.description = ev_info['description']
+        e.image_url = ev_info['image']
+        e.address = ev_info['address']
+        e.city = ev_info['city']
+        e.country = ev_info['country']
+        e.time = ev_info['startTime']
+        e.date = ev_info['startDate']
+        e.lat = ev_info['pos']['lat']
+        e.lng = ev_info['pos']['lng']
+        # category links live in another table; move the row version anyway
+        e.updated_at = datetime.utcnow()
+        EventCategory.link(e.id, ev_info['categories'], replace=True)
         db.session.commit()
-
-        categories = ev_info['categories']
-        if len(categories) > 0:
-            for category in categories:
-                evcat = EventCategory(event_id=e.id, category_id=category)
-                db.session.add(evcat)
-                db.session.commit()
+        recommender.refresh_event(e.id)
+        search_index.refresh_event(e.id)
+        delta = e.project(EDITABLE_FIELDS)
+        delta['categories'] = [c.convert_to_obj() for c in e.categs]
+        publish_update(e.id, {'type': 'event', 'event': delta})
         res = {"success": True, "event_id": e.id}
         return jsonify(res)
@@ -0,0 +1,823 @@
+import gzip
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import requests as http_requests
+from flask import current_app, request, json as flask_json
+from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import event, func
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from .geo import geohash_encode
+from .models import db, token_cache, DataVersion, User, Token, Event, Category, Interest, EventCategory, UserInterest, Attendance, Comment
+from .encoding import brotli, dumps, encode, orjson, ujson
+from .passwords import hash_password
+from .pubsub import LocalBroker
+from .ratelimit import MemoryBuckets, RateLimiter, RedisBuckets
+from .serializers import Serializer
+
+CATEGORY_NAMES = ('music', 'sports', 'tech', 'food', 'art', 'outdoors',
+                  'games', 'books', 'film', 'travel', 'languages', 'wellness')
+CITIES = (('Berlin', 'Germany', 52.52, 13.40), ('Paris', 'France', 48.86,
+                                                2.35),
+          ('London', 'United Kingdom', 51.51, -0.13),
+          ('Madrid', 'Spain', 40.42, -3.70), ('New York', 'United States',
+                                               40.71, -74.01))
+WORDS = ('jazz', 'picnic', 'hike', 'meetup', 'coffee', 'board', 'games',
+         'night', 'run', 'yoga', 'python', 'workshop', 'concert', 'market',
+         'cinema', 'brunch', 'language', 'exchange', 'climbing', 'tour')
+BATCH_SIZE = 5000
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'bench-password'
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.bulk_insert_mappings(model,
+                                        rows[start:start + BATCH_SIZE])
+        db.session.commit()
+
+
+def ids_after(model, last_id):
+    return [
+        id for (id, ) in db.session.query(model.id).filter(
+            model.id > last_id).order_by(model.id)
+    ]
+
+
+def max_id(model):
+    return db.session.query(func.coalesce(func.max(model.id), 0)).scalar()
+
+
+# Bulk-inserts a synthetic dataset with consistent denormalized counters
+# and geohashes (bulk inserts skip the ORM listeners). Every user gets the
+# same password, hashed once.
+def seed_data(users, events, attendances, comments, seed=0,
+              password='password'):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    run = '{}-{}'.format(seed, int(time.time()))
+
+    categories = {name for (name, ) in db.session.query(Category.name)}
+    insert(Category, [{
+        'name': name
+    } for name in CATEGORY_NAMES if name not in categories])
+    interests = {name for (name, ) in db.session.query(Interest.name)}
+    insert(Interest, [{
+        'name': name
+    } for name in CATEGORY_NAMES if name not in interests])
+    category_ids = [id for (id, ) in db.session.query(Category.id)]
+    interest_ids = [id for (id, ) in db.session.query(Interest.id)]
+
+    pwhash = hash_password(password)
+    last = max_id(User)
+    insert(User, [{
+        'name': 'User{}'.format(i),
+        'last_name': 'Seed',
+        'email': 'seed-{}-{}@example.com'.format(run, i),
+        'city': CITIES[i % len(CITIES)][0],
+        'country': CITIES[i % len(CITIES)][1],
+        'password': pwhash,
+    } for i in range(users)])
+    user_ids = ids_after(User, last)
+    insert(UserInterest, [{
+        'user_id': user_id,
+        'interest_id': interest_id
+    } for user_id in user_ids
+                          for interest_id in rng.sample(interest_ids, 2)])
+
+    event_rows = []
+    for i in range(events):
+        city, country, lat, lng = rng.choice(CITIES)
+        lat += rng.gauss(0, 0.05)
+        lng += rng.gauss(0, 0.08)
+        date = now + timedelta(days=rng.randint(-30, 90))
+        going = min(attendances, len(user_ids))
+        event_rows.append({
+            'creator_id': rng.choice(user_ids),
+            'title': sentence(rng, 3).capitalize(),
+            'description': sentence(rng, 20),
+            'address': '{} {}'.format(rng.randint(1, 200), city),
+            'city': city,
+            'country': country,
+            'time': date,
+            'date': date,
+            'created_at': now,
+            'updated_at': now,
+            'lat': lat,
+            'lng': lng,
+            'geohash': geohash_encode(lat, lng),
+            'attendance_count': going,
+            'comment_count': comments,
+        })
+    last = max_id(Event)
+    insert(Event, event_rows)
+    event_ids = ids_after(Event, last)
+
+    insert(EventCategory, [{
+        'event_id': event_id,
+        'category_id': category_id
+    } for event_id in event_ids
+                           for category_id in rng.sample(category_ids, 2)])
+    rows = []
+    for event_id in event_ids:
+        for user_id in rng.sample(user_ids, min(attendances, len(user_ids))):
+            rows.append({'event_id': event_id, 'user_id': user_id})
+    insert(Attendance, rows)
+    rows = []
+    for event_id in event_ids:
+        for _ in range(comments):
+            rows.append({
+                'event_id': event_id,
+                'user_id': rng.choice(user_ids),
+                'body': sentence(rng, 8),
+                'created_at': now - timedelta(minutes=rng.randint(0, 60000)),
+            })
+    insert(Comment, rows)
+    # bulk inserts skip the listeners that move the list version
+    DataVersion.bump('events')
+    db.session.commit()
+    return len(user_ids), len(event_ids)
+
+
+def bench_user():
+    user = User.query.filter_by(email=BENCH_EMAIL).first()
+    if user is None:
+        user = User(name='Bench', email=BENCH_EMAIL, city='Berlin')
+        user.set_password(BENCH_PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+    token = Token.query.filter_by(user_id=user.id).first()
+    if token is None:
+        token = Token(uuid='bench-' + str(user.id), user_id=user.id)
+        db.session.add(token)
+    db.session.commit()
+    return user.id, token.uuid
+
+
+# (name, method, request builder) for every route in app/__init__.py but
+# /logout, which would revoke the bench token, and the SSE stream, which
+# never finishes. /recover and /set-new-pw only queue an outbox row or
+# reset the bench user's password to the same one; /getpos and /getaddress
+# reach a SlowGeocoder without delay, on a new address every call.
+def scenarios(ctx):
+    rng = ctx['rng']
+
+    def event():
+        return rng.choice(ctx['event_ids'])
+
+    def city():
+        return rng.choice(CITIES)
+
+    def nearby():
+        _, _, lat, lng = city()
+        return '/geteventsnearby?lat={}&lng={}&radius=5'.format(lat, lng)
+
+    def new_event():
+        name, _, lat, lng = city()
+        return {
+            'title': 'Bench ' + sentence(rng, 2),
+            'description': sentence(rng, 10),
+            'image': None,
+            'address': 'Bench street',
+            'city': name,
+            'country': 'Benchland',
+            'startTime': None,
+            'startDate': None,
+            'pos': {
+                'lat': lat,
+                'lng': lng
+            },
+            'categories': ctx['category_ids'][:2],
+        }
+
+    def edited_event():
+        data = new_event()
+        data['id'] = rng.choice(ctx['own_event_ids'])
+        return data
+
+    def cold_token():
+        # auth without the token cache, to price what the cache saves;
+        # the same as getuser unless PUBSUB_URL enables the cache
+        token_cache.clear()
+        return '/getuser', None
+
+    def reset_link():
+        token = URLSafeTimedSerializer(ctx['secret_key']).dumps(
+            BENCH_EMAIL, salt='RESET_PASSWORD')
+        return '/set-new-pw/' + token, {'password': BENCH_PASSWORD}
+
+    def new_address():
+        ctx['geocoded'] += 1
+        return 'Bench street {} {}'.format(ctx['run'], ctx['geocoded'])
+
+    def new_position():
+        ctx['geocoded'] += 1
+        _, _, lat, lng = city()
+        return {'lat': lat + ctx['geocoded'] * 1e-3, 'lng': lng}
+
+    def register():
+        ctx['registered'] += 1
+        return {
+            'name': 'Bench',
+            'lastname': 'User',
+            'email': 'bench-{}-{}@example.com'.format(ctx['run'],
+                                                      ctx['registered']),
+            'city': 'Berlin',
+            'country': 'Germany',
+            'password': BENCH_PASSWORD,
+        }
+
+    return [
+        ('index', 'GET', lambda: ('/', None)),
+        ('geteventlist', 'GET', lambda: ('/geteventlist', None)),
+        ('geteventlist page', 'GET',
+         lambda: ('/geteventlist?limit=20', None)),
+        ('geteventlist summary', 'GET',
+         lambda: ('/geteventlist?fields=summary&limit=100', None)),
+        ('geteventinfo', 'GET',
+         lambda: ('/geteventinfo/{}'.format(event()), None)),
+        ('event comments', 'GET',
+         lambda: ('/events/{}/comments'.format(event()), None)),
+        ('geteventsnearby', 'GET', lambda: (nearby(), None)),
+        ('geteventsbylocation', 'POST',
+         lambda: ('/geteventsbylocation', ', '.join(city()[:2]))),
+        ('search', 'GET',
+         lambda: ('/search?q=' + rng.choice(WORDS)[:3], None)),
+        ('recommendations', 'GET', lambda: ('/recommendations', None)),
+        ('getuser', 'GET', lambda: ('/getuser', None)),
+        ('getuser cold token', 'GET', cold_token),
+        ('login', 'POST', lambda: ('/login', {
+            'email': BENCH_EMAIL,
+            'password': BENCH_PASSWORD
+        })),
+        ('register', 'POST', lambda: ('/register', register())),
+        ('recover', 'POST', lambda: ('/recover', {
+            'email': BENCH_EMAIL
+        })),
+        ('set-new-pw', 'POST', reset_link),
+        ('getpos', 'POST', lambda: ('/getpos', new_address())),
+        ('getaddress', 'POST', lambda: ('/getaddress', new_position())),
+        ('addaboutyou', 'POST', lambda: ('/addaboutyou', {
+            'user_id': {
+                'user_id': ctx['user_id']
+            },
+            'data': {
+                'description': sentence(rng, 5)
+            },
+            'interests': ctx['interest_ids'][:2],
+        })),
+        ('joinevent', 'POST', lambda: ('/joinevent', event())),
+        ('leaveevent', 'POST', lambda: ('/leaveevent', event())),
+        ('rsvp', 'POST', lambda: ('/rsvp', {
+            'rsvps': [{
+                'event_id': event(),
+                'attending': rng.random() < 0.5
+            } for _ in range(10)]
+        })),
+        ('comment', 'POST', lambda: ('/comment', {
+            'id': event(),
+            'comment': sentence(rng, 8)
+        })),
+        ('create-event', 'POST', lambda: ('/create-event', new_event())),
+        ('edit-event', 'POST', lambda: ('/edit-event', edited_event())),
+    ]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def query_count(response):
+    match = re.search(r'"(\d+) queries"', response.headers.get(
+        'Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+# Drives each scenario through the test client: a warmup, a timed pass for
+# latency, queries per request (from the instrumentation's Server-Timing
+# header) and commits per request, then a short tracemalloc pass for peak memory,
+# kept separate because tracing slows every allocation.
+def run_benchmark(geocoder, requests, warmup=5, memory_requests=10,
+                  only=None, seed=0):
+    app = current_app._get_current_object()
+    if not db.session.query(Event.id).first():
+        raise RuntimeError("No events to benchmark; run 'flask seed' first")
+    user_id, token = bench_user()
+    ctx = {
+        'rng': random.Random(seed),
+        'run': int(time.time()),
+        'registered': 0,
+        'geocoded': 0,
+        'secret_key': app.secret_key,
+        'user_id': user_id,
+        'event_ids': [id for (id, ) in db.session.query(Event.id)],
+        'own_event_ids':
+        [id for (id, ) in db.session.query(Event.id).filter_by(
+            creator_id=user_id)],
+        'category_ids': [id for (id, ) in db.session.query(Category.id)],
+        'interest_ids': [id for (id, ) in db.session.query(Interest.id)],
+    }
+    db.session.remove()
+    client = app.test_client()
+    headers = {'Authorization': 'Token ' + token}
+    # a benchmark hammering /login would only measure the rate limiter
+    limits = app.config['RATELIMIT_ENABLED']
+    app.config['RATELIMIT_ENABLED'] = False
+    cases = scenarios(ctx)
+    results = {}
+    commits = [0]
+
+    def count_commit(session):
+        commits[0] += 1
+
+    def send(method, path, data):
+        # a fresh app context per request, as under a real server; in the
+        # CLI's context the session, its identity map and the logged-in
+        # user would carry over and hide queries
+        with app.app_context():
+            if method == 'GET':
+                return client.get(path, headers=headers)
+            return client.post(path, json=data, headers=headers)
+
+    event.listen(db.session, 'after_commit', count_commit)
+    try:
+        if not ctx['own_event_ids']:
+            # edit-event needs an event owned by the bench user
+            path, data = dict((n, b) for n, _, b in cases)['create-event']()
+            response = send('POST', path, data)
+            ctx['own_event_ids'].append(response.get_json()['event_id'])
+        # Google is never called
+        with stub_geocoder(geocoder, 0):
+            for name, method, build in cases:
+                if only and name not in only:
+                    continue
+
+                def call():
+                    return send(method, *build())
+
+                for _ in range(warmup):
+                    call()
+                latencies = []
+                queries = []
+                statuses = set()
+                commits[0] = 0
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = call()
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    queries.append(query_count(response))
+                    statuses.add(response.status_code)
+                committed = commits[0]
+                tracemalloc.start()
+                peak = 0
+                for _ in range(memory_requests):
+                    tracemalloc.reset_peak()
+                    call()
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                results[name] = {
+                    'p50_ms': round(percentile(latencies, 50), 3),
+                    'p95_ms': round(percentile(latencies, 95), 3),
+                    'p99_ms': round(percentile(latencies, 99), 3),
+                    'queries': round(sum(queries) / float(len(queries)), 2),
+                    'commits': round(committed / float(requests), 2),
+                    'peak_kb': round(peak / 1024.0, 1),
+                    'statuses': sorted(statuses),
+                }
+    finally:
+        event.remove(db.session, 'after_commit', count_commit)
+        app.config['RATELIMIT_ENABLED'] = limits
+    return results
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save_baseline(path, results, requests, seed=0):
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                'created_at': datetime.utcnow().isoformat(),
+                'requests': requests,
+                'seed': seed,
+                'users': db.session.query(func.count(User.id)).scalar(),
+                'events': db.session.query(func.count(Event.id)).scalar(),
+                'results': results,
+            },
+            f,
+            indent=2,
+            sort_keys=True)
+
+
+# scenarios whose p95 grew by more than tolerance, or that now run more
+# queries or commits per request than in the baseline
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, row in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            found.append('{}: p95 {} ms -> {} ms'.format(
+                name, base['p95_ms'], row['p95_ms']))
+        if row['queries'] > base['queries']:
+            found.append('{}: {} -> {} queries per request'.format(
+                name, base['queries'], row['queries']))
+        if row['commits'] > base.get('commits', row['commits']):
+            found.append('{}: {} -> {} commits per request'.format(
+                name, base['commits'], row['commits']))
+    return found
+
+
+def median_ms(fn, rounds):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return percentile(times, 50)
+
+
+# nested users rendered the way User.convert_to_obj used to embed them,
+# with their events, attendances and comments
+class NestedSerializer(Serializer):
+    def user(self, user, profile='detail'):
+        return Serializer.user(self, user, profile)
+
+
+# Payload bytes and serialize time for one event with `attendees`
+# attendees, each also attending `other_events` other events, with nested
+# users as compact stubs and in the old full shape. Seeds its own rows.
+def bench_serializer(attendees, other_events=5, comments=50, rounds=5):
+    seed_data(attendees, other_events + 1, attendees, comments)
+    event_id = max_id(Event)
+    results = {}
+    for name, make in (('summary users', Serializer),
+                       ('nested users', NestedSerializer)):
+
+        def render():
+            db.session.expunge_all()
+            e = Event.with_details().filter_by(id=event_id).one()
+            return dumps(e.convert_to_obj(make()))
+
+        results[name] = {
+            'bytes': len(render().encode()),
+            'ms': round(median_ms(render, rounds), 2),
+        }
+    return results
+
+
+# Encoding and compression cost for a /geteventlist-sized payload: Flask's
+# default provider against app.encoding's encoder (orjson or ujson when
+# installed), pretty and compact, then gzip and brotli on the compact body.
+def bench_json(events=100, rounds=20):
+    config = current_app.config
+    page = Event.with_details().order_by(Event.date, Event.id).limit(
+        events).all()
+    Event.load_latest_comments(page)
+    serializer = Serializer()
+    payload = {'success': True, 'events': [e.convert_to_obj(serializer)
+                                           for e in page]}
+    backend = 'orjson' if orjson else 'ujson' if ujson else 'json'
+    encoders = [
+        ('flask default', lambda: flask_json.dumps(payload)),
+        (backend + ' pretty', lambda: encode(payload, False)),
+        (backend + ' compact', lambda: encode(payload, True)),
+    ]
+    body = encode(payload, True).encode()
+    compressors = [('gzip', lambda: gzip.compress(
+        body, compresslevel=config['COMPRESS_GZIP_LEVEL']))]
+    if brotli is not None:
+        compressors.append(('brotli', lambda: brotli.compress(
+            body, quality=config['COMPRESS_BROTLI_QUALITY'])))
+    results = {}
+    for name, fn in encoders:
+        results[name] = {
+            'bytes': len(fn().encode()),
+            'ms': round(median_ms(fn, rounds), 3)
+        }
+    for name, fn in compressors:
+        results[name] = {
+            'bytes': len(fn()),
+            'ms': round(median_ms(fn, rounds), 3)
+        }
+    return len(page), results
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+
+# A fixed pool of request threads in front of the app, like one gunicorn
+# gthread worker; with one thread it behaves like a sync worker.
+class PooledServer(BaseWSGIServer):
+    def __init__(self, app, threads):
+        BaseWSGIServer.__init__(self, '127.0.0.1', 0, app,
+                                handler=QuietHandler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.handle, request, client_address)
+
+    def handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+# answers like googlemaps.Client after a fixed delay
+class SlowGeocoder(object):
+    def __init__(self, latency):
+        self.latency = latency
+
+    def geocode(self, address):
+        time.sleep(self.latency)
+        return [{
+            'geometry': {
+                'location': {
+                    'lat': 52.52,
+                    'lng': 13.4
+                }
+            },
+            'address_components': []
+        }]
+
+    # /getaddress reads the city from the seventh result
+    def reverse_geocode(self, latlng):
+        time.sleep(self.latency)
+        return [{
+            'formatted_address': 'Bench street {}, Berlin'.format(i),
+            'types': ['street_address']
+        } for i in range(7)]
+
+
+# routes the geocoding cache to a SlowGeocoder for the duration
+@contextmanager
+def stub_geocoder(geocoder, latency):
+    factory = geocoder.client_factory
+    geocoder.client_factory = lambda: SlowGeocoder(latency)
+    geocoder._local = threading.local()
+    try:
+        yield
+    finally:
+        geocoder.client_factory = factory
+        geocoder._local = threading.local()
+
+
+# Requests per second through /getpos while Google takes `latency`
+# seconds to answer, for a single request thread and for `threads`.
+# Every address is new, so each request reaches the stub.
+def bench_upstream(geocoder, latency, requests, concurrency, threads):
+    app = current_app._get_current_object()
+    limits = app.config['RATELIMIT_ENABLED']
+    app.config['RATELIMIT_ENABLED'] = False
+    run = int(time.time())
+    results = {}
+    try:
+        with stub_geocoder(geocoder, latency):
+            for pool_size in sorted({1, threads}):
+                server = PooledServer(app, pool_size)
+                threading.Thread(target=server.serve_forever,
+                                 daemon=True).start()
+                url = 'http://127.0.0.1:{}/getpos'.format(server.server_port)
+                sessions = threading.local()
+
+                def call(i):
+                    session = getattr(sessions, 'session', None)
+                    if session is None:
+                        session = sessions.session = http_requests.Session()
+                    start = time.perf_counter()
+                    address = 'Bench street {} {} {}'.format(
+                        run, pool_size, i)
+                    response = session.post(url, json=address)
+                    response.raise_for_status()
+                    return (time.perf_counter() - start) * 1000
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as clients:
+                    latencies = list(clients.map(call, range(requests)))
+                elapsed = time.perf_counter() - start
+                server.shutdown()
+                server.server_close()
+                server.pool.shutdown()
+                results[pool_size] = {
+                    'rps': round(requests / elapsed, 1),
+                    'p50_ms': round(percentile(latencies, 50), 1),
+                    'p95_ms': round(percentile(latencies, 95), 1),
+                }
+    finally:
+        app.config['RATELIMIT_ENABLED'] = limits
+    return results
+
+
+# Microseconds per RateLimiter.check (an IP and an account bucket) on
+# fresh buckets, spread over `keys` clients; the shared backend is only
+# measured when RATELIMIT_URL is set.
+def bench_ratelimit(checks, keys=1000):
+    config = current_app.config
+    backends = [('memory', MemoryBuckets(maxsize=keys))]
+    if config['RATELIMIT_URL']:
+        backends.append(('redis', RedisBuckets.from_url(
+            config['RATELIMIT_URL'], prefix='wetribe:rl-bench:')))
+    saved = {k: config.get(k) for k in ('RATELIMIT_ENABLED',
+                                        'RATELIMIT_BENCH_IP',
+                                        'RATELIMIT_BENCH_ACCOUNT')}
+    # never exhausted, so every check takes the full path
+    config.update(RATELIMIT_ENABLED=True,
+                  RATELIMIT_BENCH_IP='1000000000/1',
+                  RATELIMIT_BENCH_ACCOUNT='1000000000/1')
+    results = {}
+    try:
+        with current_app.test_request_context('/login', method='POST'):
+            environ = request.environ
+            for name, buckets in backends:
+                limiter = RateLimiter(buckets)
+                start = time.perf_counter()
+                for i in range(checks):
+                    client = i % keys
+                    environ['REMOTE_ADDR'] = '10.{}.{}.{}'.format(
+                        client >> 16 & 255, client >> 8 & 255, client & 255)
+                    limiter.check('bench', 'user{}'.format(client))
+                elapsed = time.perf_counter() - start
+                results[name] = round(elapsed / checks * 1e6, 2)
+    finally:
+        config.update(saved)
+    return results
+
+
+# Idle SSE subscribers in one worker: memory per subscription and the time
+# one message takes to reach every subscriber of its channel. RedisBroker's
+# listener hands messages to the same in-process fan-out.
+def bench_streams(subscribers, channels=100, publishes=1000, seed=0):
+    broker = LocalBroker(queue_size=current_app.config['SSE_QUEUE_SIZE'])
+    rng = random.Random(seed)
+    message = dumps({'type': 'attendance', 'attendance': 1}, compact=True)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    by_channel = {}
+    for i in range(subscribers):
+        channel = 'event:{}'.format(i % channels)
+        by_channel.setdefault(channel, []).append(broker.subscribe(channel))
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    elapsed = 0.0
+    for _ in range(publishes):
+        channel = 'event:{}'.format(rng.randrange(channels))
+        start = time.perf_counter()
+        broker.deliver(channel, message)
+        elapsed += time.perf_counter() - start
+        # idle clients still drain what they are sent
+        for subscription in by_channel[channel]:
+            subscription.get(0)
+    for subscriptions in by_channel.values():
+        for subscription in subscriptions:
+            broker.unsubscribe(subscription)
+    return {
+        'bytes_per_subscriber': int(memory / float(subscribers)),
+        'deliver_ms': round(elapsed / publishes * 1000, 3),
+        'per_channel': subscribers // channels,
+        'dropped': broker.dropped,
+    }
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def rss_kb(pid):
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def worker_pid(master):
+    path = '/proc/{0}/task/{0}/children'.format(master)
+    with open(path) as f:
+        children = f.read().split()
+    return int(children[0]) if children else None
+
+
+def open_stream(port, event_id):
+    conn = socket.create_connection(('127.0.0.1', port), timeout=10)
+    conn.sendall('GET /events/{}/stream HTTP/1.1\r\nHost: bench\r\n\r\n'.
+                 format(event_id).encode())
+    head = conn.recv(4096)
+    return conn, head.split(b' ', 2)[1] == b'200'
+
+
+# Serves the app with gunicorn's gevent worker (one worker, this tree's
+# gunicorn.conf.py, the bench database) and holds `connections` idle SSE
+# streams on one event. Reports the worker's resident memory per stream,
+# how many streams still got a heartbeat, and /geteventlist latency while
+# they are held. Needs gunicorn, gevent and psycogreen
+# (requirements-gevent.txt) and /proc.
+def bench_gevent_streams(event_id, connections, heartbeat=1.0, probes=20,
+                         startup=30):
+    port = free_port()
+    env = dict(os.environ,
+               DATABASE_URL=current_app.config['SQLALCHEMY_DATABASE_URI'],
+               GUNICORN_WORKER_CLASS='gevent',
+               WEB_CONCURRENCY='1',
+               GUNICORN_WORKER_CONNECTIONS=str(connections + probes + 10),
+               SSE_MAX_STREAMS=str(connections),
+               SSE_HEARTBEAT=str(heartbeat),
+               RATELIMIT_ENABLED='0')
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b',
+        '127.0.0.1:{}'.format(port), 'app:app'
+    ],
+                              cwd=ROOT,
+                              env=env,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}/geteventlist?limit=5'.format(port)
+    streams = []
+    try:
+        deadline = time.monotonic() + startup
+        while True:
+            try:
+                http_requests.get(url, timeout=10)
+                break
+            except http_requests.ConnectionError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+        worker = worker_pid(server.pid)
+        # one stream first, so imports and pools are not counted per stream
+        conn, _ = open_stream(port, event_id)
+        conn.close()
+        before = rss_kb(worker)
+        start = time.perf_counter()
+        refused = 0
+        for _ in range(connections):
+            conn, accepted = open_stream(port, event_id)
+            if accepted:
+                streams.append(conn)
+            else:
+                refused += 1
+                conn.close()
+        opened = time.perf_counter() - start
+        held = rss_kb(worker) - before
+        times = []
+        for _ in range(probes):
+            start = time.perf_counter()
+            http_requests.get(url, timeout=10)
+            times.append((time.perf_counter() - start) * 1000)
+        # drain the snapshots, then wait for a heartbeat on every stream
+        for conn in streams:
+            conn.settimeout(0)
+            try:
+                while conn.recv(65536):
+                    pass
+            except (BlockingIOError, socket.timeout):
+                pass
+        time.sleep(heartbeat * 2 + 0.5)
+        alive = 0
+        for conn in streams:
+            try:
+                alive += b'keepalive' in conn.recv(65536)
+            except (BlockingIOError, socket.timeout):
+                pass
+        return {
+            'streams': len(streams),
+            'refused': refused,
+            'open_s': round(opened, 2),
+            'kb_per_stream': round(held / float(max(1, len(streams))), 1),
+            'heartbeats': alive,
+            'p50_ms': round(percentile(times, 50), 2),
+            'p95_ms': round(percentile(times, 95), 2),
+        }
+    finally:
+        for conn in streams:
+            conn.close()
+        server.terminate()
+        server.wait()
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+_fake_server = None
+_fake_lock = threading.Lock()
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            expires_at, value = self._data.get(key, (None, 0))
+            self._data[key] = (expires_at, value + 1)
+            self._data.move_to_end(key)
+            return value + 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+# redis-py client for url; "fakeredis://" gives an in-process stand-in
+# (pip install fakeredis lupa), shared by everything in this process, for
+# development and tests without a Redis server
+def redis_client(url, setting='CACHE_URL'):
+    global _fake_server
+    if url.startswith('fakeredis://'):
+        if fakeredis is None:
+            raise RuntimeError(
+                "{} needs the fakeredis package installed".format(setting))
+        with _fake_lock:
+            if _fake_server is None:
+                _fake_server = fakeredis.FakeServer()
+        return fakeredis.FakeRedis(server=_fake_server)
+    if redis is None:
+        raise RuntimeError(
+            "{} needs the redis package installed".format(setting))
+    return redis.Redis.from_url(url)
+
+
+# same get/set/incr/delete surface as LRUCache, shared across workers;
+# any redis-py compatible client can be passed in
+class RedisCache(object):
+    def __init__(self, client, prefix='wetribe:', ttl=None, decode=True):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        # False hands values back as bytes, for binary payloads
+        self.decode = decode
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        return cls(redis_client(url), **kwargs)
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return default
+        if self.decode and isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl:
+            self.client.setex(self.prefix + key, int(ttl), value)
+        else:
+            self.client.set(self.prefix + key, value)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {}
+
+
+def make_cache(url=None, maxsize=1024, ttl=None, decode=True):
+    if url:
+        return RedisCache.from_url(url, ttl=ttl, decode=decode)
+    return LRUCache(maxsize=maxsize, ttl=ttl)
+
+
+# Shared response bodies, one entry per variant (an event, a list query,
+# a comment page) holding the version it was built from, so a newer body
+# replaces the old one instead of leaving it behind until eviction. The
+# versions come from the database (events.updated_at, data_versions), so
+# a write served by one worker invalidates the bodies in all of them.
+# Compressed copies live next to the body, one per Content-Encoding.
+# Entries are bytes, so a Redis backend needs decode=False.
+class ResponseCache(object):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def event_key(self, event_id):
+        return 'body:event:{}'.format(event_id)
+
+    def list_key(self, variant):
+        return 'body:events:{}'.format(variant)
+
+    def get(self, key, version):
+        data = self.get_bytes(key, version)
+        return None if data is None else data.decode()
+
+    def set(self, key, version, body):
+        self.set_bytes(key, version, body.encode())
+
+    def get_encoded(self, key, version, encoding):
+        return self.get_bytes('{}:{}'.format(key, encoding), version)
+
+    def set_encoded(self, key, version, encoding, data):
+        self.set_bytes('{}:{}'.format(key, encoding), version, data)
+
+    def get_bytes(self, key, version):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        stored, _, data = entry.partition(b'\n')
+        return data if stored == str(version).encode() else None
+
+    def set_bytes(self, key, version, data):
+        self.backend.set(key, str(version).encode() + b'\n' + data)
@@ -1,6 +1,15 @@
 import click
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 from flask.cli import with_appcontext
-from .models import db
+from sqlalchemy import func, or_, select, text
+from .bench import seed_data, run_benchmark, save_baseline, load_baseline, regressions, bench_serializer, bench_json, bench_upstream, bench_ratelimit, bench_streams, bench_gevent_streams
+from .mailer import dispatch
+from .passwords import check_hash, current_method, generate_hash
+from .models import db, Event, Attendance, Comment
 
 
 @click.command(name="createdb")
@@ -9,3 +18,280 @@ def create_db():
     db.create_all()
     db.session.commit()
     print("Database tables created")
+
+
+@click.command(name="seed")
+@click.option("--users", default=1000)
+@click.option("--events", default=5000)
+@click.option("--attendances", default=20, help="Attendees per event.")
+@click.option("--comments", default=10, help="Comments per event.")
+@click.option("--seed", "seed_value", default=0, help="Random seed.")
+@click.option("--password", default="password", help="For every user.")
+@with_appcontext
+def seed(users, events, attendances, comments, seed_value, password):
+    start = time.perf_counter()
+    users, events = seed_data(users, events, attendances, comments,
+                              seed_value, password)
+    print("Seeded {} users and {} events in {:.1f}s".format(
+        users, events,
+        time.perf_counter() - start))
+
+
+@click.command(name="reconcilecounts")
+@with_appcontext
+def reconcile_counts():
+    attendances = select([func.count(Attendance.id)
+                          ]).where(Attendance.event_id == Event.id).as_scalar()
+    comments = select([func.count(Comment.id)
+                       ]).where(Comment.event_id == Event.id).as_scalar()
+    result = db.session.execute(Event.__table__.update().where(
+        or_(Event.attendance_count != attendances,
+            Event.comment_count != comments)).values(
+                attendance_count=attendances, comment_count=comments))
+    db.session.commit()
+    print("Reconciled counters on {} events".format(result.rowcount))
+
+
+@click.command(name="sendmail")
+@click.option("--once", is_flag=True, help="Drain the outbox and exit.")
+@click.option("--batch-size", default=50)
+@click.option("--interval", default=2.0, help="Idle poll interval (s).")
+@with_appcontext
+def send_mail(once, batch_size, interval):
+    while True:
+        sent = dispatch(batch_size)
+        if not sent:
+            if once:
+                break
+            time.sleep(interval)
+
+
+# (name, table, query) for the main lookup behind each endpoint
+INDEX_CHECKS = [
+    ('login / register / recover', 'users',
+     "SELECT id FROM users WHERE email = 'a@b.c'"),
+    ('token auth', 'token',
+     "SELECT users.id FROM users JOIN token ON token.user_id = users.id "
+     "WHERE token.uuid = 'x'"),
+    ('logout', 'token', "SELECT id FROM token WHERE user_id = 1"),
+    ('attendance check', 'attendances',
+     "SELECT id FROM attendances WHERE event_id = 1 AND user_id = 1"),
+    ('user attendances', 'attendances',
+     "SELECT event_id FROM attendances WHERE user_id = 1"),
+    ('event categories', 'eventcategories',
+     "SELECT category_id FROM eventcategories WHERE event_id IN (1, 2)"),
+    ('user interests', 'userinterests',
+     "SELECT interest_id FROM userinterests WHERE user_id IN (1, 2)"),
+    ('event comments', 'comments',
+     "SELECT id FROM comments WHERE event_id IN (1, 2)"),
+    ('comment page', 'comments',
+     "SELECT id FROM comments WHERE event_id = 1 "
+     "ORDER BY created_at DESC, id DESC LIMIT 20"),
+    ('events by city', 'events', "SELECT id FROM events WHERE city = 'x'"),
+    ('events nearby', 'events',
+     "SELECT id FROM events WHERE geohash >= 'u33' AND geohash < 'u34'"),
+    ('event list page', 'events',
+     "SELECT id FROM events WHERE date >= '2020-01-01' "
+     "ORDER BY date, id LIMIT 20"),
+]
+
+
+def explain(conn, query):
+    if conn.dialect.name == 'postgresql':
+        return [row[0] for row in conn.execute(text('EXPLAIN ' + query))]
+    return [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + query))]
+
+
+def uses_index(dialect, table, plan):
+    if dialect == 'postgresql':
+        return not any('Seq Scan on ' + table in line for line in plan)
+    lines = [line for line in plan if re.search(r'\b%s\b' % table, line)]
+    return all('USING' in line for line in lines)
+
+
+@click.command(name="checkindexes")
+@with_appcontext
+def check_indexes():
+    conn = db.session.connection()
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        # tiny tables would otherwise always be scanned sequentially
+        conn.execute(text('SET LOCAL enable_seqscan = off'))
+    failed = 0
+    for name, table, query in INDEX_CHECKS:
+        plan = explain(conn, query)
+        ok = uses_index(dialect, table, plan)
+        failed += not ok
+        print("{} {}".format('ok  ' if ok else 'FAIL', name))
+        if not ok:
+            for line in plan:
+                print("       " + line)
+    db.session.rollback()
+    if failed:
+        raise click.ClickException("{} queries without index".format(failed))
+
+
+# verifications per second with the configured hash parameters, on one
+# thread and on PASSWORD_HASH_WORKERS threads; use it to pick a cost that
+# keeps login capacity above the expected peak
+@click.command(name="benchpasswords")
+@click.option("--seconds", default=3.0, help="Duration of each run (s).")
+@with_appcontext
+def bench_passwords(seconds):
+    method = current_method(current_app.config)
+    pwhash = generate_hash('benchmark-password', method)
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    print("{} on {} cpus".format(method, os.cpu_count()))
+    for threads in sorted({1, workers}):
+        deadline = time.perf_counter() + seconds
+
+        def run():
+            done = 0
+            while time.perf_counter() < deadline:
+                check_hash(pwhash, 'benchmark-password')
+                done += 1
+            return done
+
+        with ThreadPoolExecutor(threads) as pool:
+            futures = [pool.submit(run) for _ in range(threads)]
+            done = sum(f.result() for f in futures)
+        print("{:>2} threads: {:8.1f} logins/s ({:.1f} ms each)".format(
+            threads, done / seconds, seconds * threads * 1000.0 / done))
+
+
+# run against a seeded scratch database: the write scenarios add rows
+@click.command(name="bench")
+@click.option("--requests", default=100, help="Timed requests per route.")
+@click.option("--warmup", default=5)
+@click.option("--route", "routes", multiple=True, help="Only these routes.")
+@click.option("--seed", "seed_value", default=0, help="Random seed.")
+@click.option("--save", type=click.Path(), help="Write results as baseline.")
+@click.option("--compare", type=click.Path(exists=True),
+              help="Baseline to compare against.")
+@click.option("--tolerance", default=0.2, help="Allowed p95 growth.")
+@with_appcontext
+def bench(requests, warmup, routes, seed_value, save, compare, tolerance):
+    # imported here: the app package imports this module
+    from . import gmaps
+    try:
+        results = run_benchmark(gmaps,
+                                requests,
+                                warmup,
+                                only=set(routes),
+                                seed=seed_value)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    baseline = load_baseline(compare) if compare else {}
+    print("{:<22} {:>9} {:>9} {:>9} {:>8} {:>8} {:>9}".format(
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'commits',
+        'peak KB'))
+    for name, row in results.items():
+        line = "{:<22} {:>9} {:>9} {:>9} {:>8} {:>8} {:>9}".format(
+            name, row['p50_ms'], row['p95_ms'], row['p99_ms'], row['queries'],
+            row['commits'], row['peak_kb'])
+        if name in baseline:
+            line += "  (p95 was {})".format(baseline[name]['p95_ms'])
+        if any(status >= 400 for status in row['statuses']):
+            line += "  status {}".format(row['statuses'])
+        print(line)
+    if save:
+        save_baseline(save, results, requests, seed_value)
+        print("Baseline written to {}".format(save))
+    if compare:
+        found = regressions(results, baseline, tolerance)
+        for line in found:
+            print("REGRESSION " + line)
+        if found:
+            raise click.ClickException("{} regressions".format(len(found)))
+
+
+# seeds one popular event into a scratch database and renders it with
+# nested users as stubs and in their old full shape
+@click.command(name="benchserialize")
+@click.option("--attendees", default=1000)
+@click.option("--other-events", default=5,
+              help="Events each attendee also attends.")
+@click.option("--comments", default=50)
+@click.option("--rounds", default=5)
+@with_appcontext
+def bench_serialize(attendees, other_events, comments, rounds):
+    results = bench_serializer(attendees, other_events, comments, rounds)
+    print("{:<16} {:>12} {:>10}".format('shape', 'bytes', 'ms'))
+    for name, row in results.items():
+        print("{:<16} {:>12} {:>10}".format(name, row['bytes'], row['ms']))
+
+
+# runs against a seeded database; compare the rows before enabling
+# orjson or brotli in production
+@click.command(name="benchjson")
+@click.option("--events", default=100, help="Events in the payload.")
+@click.option("--rounds", default=20)
+@with_appcontext
+def bench_json_encoding(events, rounds):
+    count, results = bench_json(events, rounds)
+    print("{} events".format(count))
+    print("{:<16} {:>12} {:>10}".format('encoder', 'bytes', 'ms'))
+    for name, row in results.items():
+        print("{:<16} {:>12} {:>10}".format(name, row['bytes'], row['ms']))
+
+
+# /getpos under a stubbed Google that answers after --latency seconds,
+# served by one request thread and by --threads, as gthread would
+@click.command(name="benchupstream")
+@click.option("--latency", default=0.3, help="Upstream delay (s).")
+@click.option("--requests", default=100)
+@click.option("--concurrency", default=32, help="Concurrent clients.")
+@click.option("--threads", default=8, help="Request threads per worker.")
+@with_appcontext
+def bench_upstream_latency(latency, requests, concurrency, threads):
+    # imported here: the app package imports this module
+    from . import gmaps
+    results = bench_upstream(gmaps, latency, requests, concurrency, threads)
+    print("{:<10} {:>8} {:>9} {:>9}".format('threads', 'req/s', 'p50 ms',
+                                            'p95 ms'))
+    for pool_size, row in results.items():
+        print("{:<10} {:>8} {:>9} {:>9}".format(pool_size, row['rps'],
+                                                row['p50_ms'], row['p95_ms']))
+
+
+@click.command(name="benchratelimit")
+@click.option("--checks", default=100000)
+@click.option("--keys", default=1000, help="Distinct clients.")
+@with_appcontext
+def bench_rate_limiter(checks, keys):
+    for name, micros in bench_ratelimit(checks, keys).items():
+        print("{:<8} {:>8} us per check".format(name, micros))
+
+
+# the broker's share in-process, then --connections real idle streams
+# held against gunicorn's gevent worker on the seeded database
+@click.command(name="benchstreams")
+@click.option("--subscribers", default=5000)
+@click.option("--channels", default=100, help="Events subscribed to.")
+@click.option("--publishes", default=1000)
+@click.option("--connections", default=1000,
+              help="Idle streams held open; 0 skips the server run.")
+@click.option("--heartbeat", default=1.0, help="SSE_HEARTBEAT (s).")
+@with_appcontext
+def bench_idle_streams(subscribers, channels, publishes, connections,
+                       heartbeat):
+    row = bench_streams(subscribers, channels, publishes)
+    print("{} subscribers, {} per event".format(subscribers,
+                                               row['per_channel']))
+    print("{:>8} bytes per idle subscriber".format(
+        row['bytes_per_subscriber']))
+    print("{:>8} ms to deliver one update to its event's subscribers".format(
+        row['deliver_ms']))
+    print("{:>8} messages dropped".format(row['dropped']))
+    if not connections:
+        return
+    event_id = db.session.query(func.min(Event.id)).scalar()
+    if event_id is None:
+        raise click.ClickException("Seed the database first")
+    row = bench_gevent_streams(event_id, connections, heartbeat)
+    print("gevent worker, {} streams held ({} refused) in {}s".format(
+        row['streams'], row['refused'], row['open_s']))
+    print("{:>8} KB resident per stream".format(row['kb_per_stream']))
+    print("{:>8} streams got a heartbeat".format(row['heartbeats']))
+    print("{:>8} ms p50, {} ms p95 /geteventlist meanwhile".format(
+        row['p50_ms'], row['p95_ms']))
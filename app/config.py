@@ -1,13 +1,108 @@
 import os
 from dotenv import load_dotenv
+from .dbpool import InstrumentedQueuePool
+from .routing import replica_binds
 load_dotenv()
 
 
+def engine_options(uri):
+    if not uri or uri.startswith("sqlite"):
+        return {}
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE") or 5),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 5),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT") or 10),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE") or 1800),
+        "pool_pre_ping": (os.environ.get("DB_POOL_PRE_PING") or "1") == "1",
+    }
+    statement_timeout = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS") or 15000)
+    if uri.startswith("postgres") and statement_timeout:
+        options["connect_args"] = {
+            "options": "-c statement_timeout={}".format(statement_timeout)
+        }
+    return options
+
+
 class Config(object):
     SECRET_KEY = os.environ.get("FLASK_SECRET_KEY") or "supersekrit"
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_BINDS = replica_binds(os.environ.get("DATABASE_REPLICA_URLS"))
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS") or 10)
     FACEBOOK_OAUTH_CLIENT_ID = os.environ.get("FACEBOOK_OAUTH_CLIENT_ID")
     FACEBOOK_OAUTH_CLIENT_SECRET = os.environ.get(
         "FACEBOOK_OAUTH_CLIENT_SECRET")
     EMAIL_API = os.environ.get("EMAIL_API")
+    MAILGUN_URL = os.environ.get("MAILGUN_URL") or (
+        "https://api.mailgun.net/v3/"
+        "sandboxd25ec24b7b1d4277aaeac6b2622859f5.mailgun.org/messages")
+    MAIL_FROM = os.environ.get("MAIL_FROM") or "Ricardo <fitoskalante@gmail.com>"
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS") or 6)
+    MAIL_RETRY_BASE = int(os.environ.get("MAIL_RETRY_BASE") or 30)
+    MAIL_CONCURRENCY = int(os.environ.get("MAIL_CONCURRENCY") or 4)
+    GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE") or 1024)
+    GEOCODE_CACHE_TTL = int(
+        os.environ.get("GEOCODE_CACHE_TTL") or 30 * 24 * 3600)
+    GEOCODE_TIMEOUT = int(os.environ.get("GEOCODE_TIMEOUT") or 5)
+    GEOCODE_GRID_DECIMALS = int(os.environ.get("GEOCODE_GRID_DECIMALS") or 4)
+    # API token snapshots, only kept with PUBSUB_URL (see models.TokenCache)
+    TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE") or 4096)
+    TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL") or 60)
+    # redis://... shared by all workers; fakeredis:// for a local stand-in
+    CACHE_URL = os.environ.get("CACHE_URL")
+    CACHE_SIZE = int(os.environ.get("CACHE_SIZE") or 512)
+    CACHE_TTL = int(os.environ.get("CACHE_TTL") or 300)
+    JSON_COMPACT = (os.environ.get("JSON_COMPACT") or "1") == "1"
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE") or 1024)
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL") or 6)
+    COMPRESS_BROTLI_QUALITY = int(
+        os.environ.get("COMPRESS_BROTLI_QUALITY") or 4)
+    INTERNAL_API_KEY = os.environ.get("INTERNAL_API_KEY")
+    LOG_LEVEL = os.environ.get("LOG_LEVEL") or "INFO"
+    LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE") or 0.01)
+    SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS") or 500)
+    RECOMMENDATION_INDEX_TTL = int(
+        os.environ.get("RECOMMENDATION_INDEX_TTL") or 300)
+    SEARCH_INDEX_TTL = int(os.environ.get("SEARCH_INDEX_TTL") or 300)
+    # number of proxies in front of the app whose X-Forwarded-For we trust;
+    # one for the Heroku router, set 0 when clients connect directly
+    TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES") or 1)
+    RATELIMIT_ENABLED = (os.environ.get("RATELIMIT_ENABLED") or "1") == "1"
+    RATELIMIT_URL = os.environ.get("RATELIMIT_URL") or CACHE_URL
+    RATELIMIT_MEMORY_SIZE = int(
+        os.environ.get("RATELIMIT_MEMORY_SIZE") or 10000)
+    RATELIMIT_AUTH_IP = os.environ.get("RATELIMIT_AUTH_IP") or "20/60"
+    RATELIMIT_AUTH_ACCOUNT = os.environ.get("RATELIMIT_AUTH_ACCOUNT") or "5/60"
+    RATELIMIT_GEOCODE_IP = os.environ.get("RATELIMIT_GEOCODE_IP") or "30/60"
+    RATELIMIT_GEOCODE_ACCOUNT = (os.environ.get("RATELIMIT_GEOCODE_ACCOUNT")
+                                 or "60/60")
+    PASSWORD_HASH_METHOD = (os.environ.get("PASSWORD_HASH_METHOD")
+                            or "pbkdf2:sha256")
+    PASSWORD_HASH_ITERATIONS = int(
+        os.environ.get("PASSWORD_HASH_ITERATIONS") or 260000)
+    PASSWORD_SCRYPT_N = int(os.environ.get("PASSWORD_SCRYPT_N") or 32768)
+    PASSWORD_SCRYPT_R = int(os.environ.get("PASSWORD_SCRYPT_R") or 8)
+    PASSWORD_SCRYPT_P = int(os.environ.get("PASSWORD_SCRYPT_P") or 1)
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS") or 2)
+    # hashing plus queued callers may hold at most half of GUNICORN_THREADS,
+    # so a login burst leaves request threads for everything else
+    PASSWORD_HASH_QUEUE = int(
+        os.environ.get("PASSWORD_HASH_QUEUE")
+        or max(0, int(os.environ.get("GUNICORN_THREADS") or 8) // 2 -
+               PASSWORD_HASH_WORKERS))
+    # seconds to wait for a slot; 0 refuses at once
+    PASSWORD_HASH_WAIT = float(os.environ.get("PASSWORD_HASH_WAIT") or 0)
+    PUBSUB_URL = os.environ.get("PUBSUB_URL") or CACHE_URL
+    SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT") or 15)
+    SSE_RETRY_MS = int(os.environ.get("SSE_RETRY_MS") or 5000)
+    SSE_QUEUE_SIZE = int(os.environ.get("SSE_QUEUE_SIZE") or 100)
+    # open streams per worker; under gthread each holds one of
+    # GUNICORN_THREADS, so by default half of them stay free for requests
+    SSE_MAX_STREAMS = int(
+        os.environ.get("SSE_MAX_STREAMS")
+        or (int(os.environ.get("GUNICORN_WORKER_CONNECTIONS") or 1000)
+            if os.environ.get("GUNICORN_WORKER_CLASS") == "gevent" else
+            max(1, int(os.environ.get("GUNICORN_THREADS") or 8) // 2)))
+    EVENT_RECENT_COMMENTS = int(os.environ.get("EVENT_RECENT_COMMENTS") or 5)
@@ -0,0 +1,119 @@
+import gzip
+import json
+import uuid
+from datetime import date, datetime
+from flask import current_app, request
+from werkzeug.http import http_date
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain')
+
+
+# same wire format as Flask's default encoder, so clients see no change
+def default(o):
+    if isinstance(o, datetime):
+        return http_date(o.utctimetuple())
+    if isinstance(o, date):
+        return http_date(o.timetuple())
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    raise TypeError("{!r} is not JSON serializable".format(o))
+
+
+def dumps(obj, compact=None):
+    with timed('serialize'):
+        return encode(obj, compact)
+
+
+def encode(obj, compact):
+    if compact is None:
+        compact = current_app.config['JSON_COMPACT']
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode()
+    if ujson is not None:
+        return ujson.dumps(obj,
+                           default=default,
+                           ensure_ascii=False,
+                           indent=0 if compact else 2)
+    if compact:
+        return json.dumps(obj, default=default, separators=(',', ':'))
+    return json.dumps(obj, default=default, indent=2)
+
+
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError("jsonify() takes either args or kwargs, not both")
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    return current_app.response_class(dumps(data) + '\n',
+                                      mimetype='application/json')
+
+
+# the Content-Encoding this request accepts, best first
+def preferred_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compressible(size):
+    return size >= current_app.config['COMPRESS_MIN_SIZE']
+
+
+def compress(data, encoding):
+    config = current_app.config
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'])
+
+
+# a body that is already compressed, e.g. from the response cache
+def encoded_response(data, encoding, mimetype='application/json'):
+    response = current_app.response_class(data, mimetype=mimetype)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# responses that arrive with a Content-Encoding are left alone, so cached
+# compressed bodies are sent as they are
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if not compressible(len(data)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = preferred_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
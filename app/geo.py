@@ -0,0 +1,82 @@
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits = bits * 2
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2**lat_bits, 360.0 / 2**lng_bits
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = (math.sin(dphi / 2)**2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2)**2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# finest precision whose cells are at least radius_km wide at this latitude,
+# so the 3x3 block around the centre cell covers the whole search circle
+def search_precision(lat, radius_km):
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lng_deg = cell_size(precision)
+        height = lat_deg * KM_PER_DEGREE
+        width = lng_deg * KM_PER_DEGREE * cos_lat
+        if min(height, width) >= radius_km:
+            return precision
+    return 0
+
+
+def covering_cells(lat, lng, radius_km):
+    precision = search_precision(lat, radius_km)
+    if precision == 0:
+        return None
+    lat_deg, lng_deg = cell_size(precision)
+    cells = set()
+    for dlat in (-lat_deg, 0, lat_deg):
+        for dlng in (-lng_deg, 0, lng_deg):
+            clat = max(-90.0, min(90.0, lat + dlat))
+            clng = (lng + dlng + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(clat, clng, precision))
+    return sorted(cells)
+
+
+# a geohash prefix as a half-open [lower, upper) string range, usable by a
+# B-tree index; upper is None when the prefix is all 'z'
+def prefix_range(prefix):
+    head = prefix.rstrip('z')
+    if not head:
+        return prefix, None
+    return prefix, head[:-1] + BASE32[BASE32.index(head[-1]) + 1]
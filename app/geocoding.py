@@ -0,0 +1,86 @@
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from .cache import LRUCache
+from .instrumentation import timed
+from .models import db, GeocodeResult
+
+
+def normalize_address(address):
+    address = ' '.join(str(address).lower().split())
+    return re.sub(r'\s*,\s*', ', ', address).strip(' ,')
+
+
+# two tiers in front of googlemaps.Client: an in-process LRU, then the
+# geocode_results table; only misses on both reach Google. client_factory
+# builds one client per thread, as googlemaps.Client is not thread-safe.
+class GeocodingCache(object):
+    def __init__(self,
+                 client_factory,
+                 maxsize=1024,
+                 ttl=30 * 24 * 3600,
+                 grid=4):
+        self.client_factory = client_factory
+        self._local = threading.local()
+        self.ttl = ttl
+        self.grid = grid
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.db_hits = 0
+        self.misses = 0
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.client_factory()
+        return client
+
+    def geocode(self, address):
+        key = 'geocode:' + normalize_address(address)
+        return self._lookup(key, lambda: self.client.geocode(address))
+
+    def reverse_geocode(self, latlng):
+        lat = round(float(latlng[0]), self.grid)
+        lng = round(float(latlng[1]), self.grid)
+        key = 'reverse:{:.{g}f},{:.{g}f}'.format(lat, lng, g=self.grid)
+        return self._lookup(key,
+                            lambda: self.client.reverse_geocode((lat, lng)))
+
+    def stats(self):
+        return {
+            'memory_hits': self.memory.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'memory_size': len(self.memory),
+        }
+
+    def _lookup(self, key, fetch):
+        result = self.memory.get(key)
+        if result is not None:
+            return result
+
+        row = GeocodeResult.query.filter_by(key=key).first()
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.ttl)
+        if row and row.created_at >= fresh_after:
+            self.db_hits += 1
+            result = json.loads(row.result)
+            self.memory.set(key, result)
+            return result
+
+        self.misses += 1
+        with timed('http'):
+            result = fetch()
+        if row:
+            row.result = json.dumps(result)
+            row.created_at = datetime.utcnow()
+        else:
+            db.session.add(GeocodeResult(key=key, result=json.dumps(result)))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker stored the same key first
+            db.session.rollback()
+        self.memory.set(key, result)
+        return result
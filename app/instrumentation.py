@@ -0,0 +1,183 @@
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger('wetribe')
+
+TIMING_KINDS = ('db', 'http', 'serialize')
+
+
+def current_timings():
+    if has_request_context():
+        return g.get('timings')
+    return None
+
+
+@contextmanager
+def timed(kind):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings()
+        if timings is not None:
+            timings[kind] += time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    start = conn.info['query_start'].pop()
+    timings = current_timings()
+    if timings is not None:
+        timings['db'] += time.perf_counter() - start
+        timings['queries'] += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def log_event(name, **fields):
+    if log.isEnabledFor(logging.DEBUG):
+        fields['event'] = name
+        log.debug(json.dumps(fields, default=str))
+
+
+# per-endpoint totals since the worker started, rendered in the Prometheus
+# text format
+class Metrics(object):
+    FIELDS = (
+        ('requests_total', 'Requests handled.'),
+        ('request_errors_total', 'Requests answered with a 5xx status.'),
+        ('request_seconds_total', 'Wall time spent handling requests.'),
+        ('db_queries_total', 'SQL statements executed.'),
+        ('db_seconds_total', 'Time spent in SQL statements.'),
+        ('http_seconds_total', 'Time spent in outbound HTTP calls.'),
+        ('serialize_seconds_total', 'Time spent encoding JSON.'),
+    )
+
+    def __init__(self, prefix='wetribe_'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, endpoint, status, total, timings):
+        with self._lock:
+            row = self._endpoints[endpoint]
+            row['requests_total'] += 1
+            row['request_errors_total'] += status >= 500
+            row['request_seconds_total'] += total
+            row['db_queries_total'] += timings['queries']
+            row['db_seconds_total'] += timings['db']
+            row['http_seconds_total'] += timings['http']
+            row['serialize_seconds_total'] += timings['serialize']
+
+    def render(self, gauges=None):
+        lines = []
+        with self._lock:
+            for field, help in self.FIELDS:
+                name = self.prefix + field
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} counter'.format(name))
+                for endpoint, row in sorted(self._endpoints.items()):
+                    lines.append('{}{{endpoint="{}"}} {}'.format(
+                        name, endpoint, format_value(row[field])))
+        for name, value in sorted((gauges or {}).items()):
+            lines.append('# TYPE {}{} gauge'.format(self.prefix, name))
+            lines.append('{}{} {}'.format(self.prefix, name,
+                                          format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(round(value, 6))
+    return str(int(value))
+
+
+def flatten_stats(stats, prefix=''):
+    flat = {}
+    for key, value in stats.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten_stats(value, name + '_'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+class Instrumentation(object):
+    def __init__(self, app=None):
+        self.metrics = Metrics()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not log.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            log.addHandler(handler)
+            log.setLevel(app.config['LOG_LEVEL'])
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        g.request_start = time.perf_counter()
+        g.timings = defaultdict(float, queries=0)
+
+    def after_request(self, response):
+        timings = g.get('timings')
+        if timings is None:
+            return response
+        total = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unmatched'
+        self.metrics.observe(endpoint, response.status_code, total, timings)
+        response.headers['Server-Timing'] = server_timing(total, timings)
+
+        slow = total * 1000 >= current_app.config['SLOW_REQUEST_MS']
+        if (slow or response.status_code >= 500
+                or random.random() < current_app.config['LOG_SAMPLE_RATE']):
+            log.info(
+                json.dumps({
+                    'event': 'request',
+                    'endpoint': endpoint,
+                    'method': request.method,
+                    'status': response.status_code,
+                    'ms': round(total * 1000, 2),
+                    'queries': timings['queries'],
+                    'db_ms': round(timings['db'] * 1000, 2),
+                    'http_ms': round(timings['http'] * 1000, 2),
+                    'serialize_ms': round(timings['serialize'] * 1000, 2),
+                    'slow': slow,
+                }))
+        return response
+
+
+def server_timing(total, timings):
+    parts = [
+        'db;dur={:.2f};desc="{} queries"'.format(timings['db'] * 1000,
+                                                 timings['queries'])
+    ]
+    for kind in TIMING_KINDS[1:]:
+        parts.append('{};dur={:.2f}'.format(kind, timings[kind] * 1000))
+    parts.append('total;dur={:.2f}'.format(total * 1000))
+    return ', '.join(parts)
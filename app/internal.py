@@ -0,0 +1,63 @@
+import hmac
+from flask import Blueprint, abort, current_app, request
+from .dbpool import pool_stats
+from .encoding import jsonify
+from .instrumentation import flatten_stats
+from .models import db
+
+# operational endpoints; disabled unless INTERNAL_API_KEY is set, and then
+# only reachable with a matching X-Internal-Key or bearer token
+blueprint = Blueprint('internal', __name__)
+
+stats_providers = {}
+metrics = None
+
+
+def register_stats(name, provider):
+    stats_providers[name] = provider
+
+
+def register_metrics(request_metrics):
+    global metrics
+    metrics = request_metrics
+
+
+@blueprint.before_request
+def check_internal_key():
+    key = current_app.config['INTERNAL_API_KEY']
+    given = request.headers.get('X-Internal-Key', '')
+    auth = request.headers.get('Authorization', '')
+    if not given and auth.startswith('Bearer '):
+        given = auth[len('Bearer '):]
+    if not key or not hmac.compare_digest(given, key):
+        abort(404)
+
+
+def all_pool_stats():
+    res = {'primary': pool_stats(db.engine)}
+    for key, engine in db.replica_engines().items():
+        res[key] = pool_stats(engine)
+    return res
+
+
+@blueprint.route('/pool')
+def pool():
+    return jsonify(all_pool_stats())
+
+
+@blueprint.route('/stats')
+def stats():
+    res = {name: provider() for name, provider in stats_providers.items()}
+    res['pool'] = all_pool_stats()
+    return jsonify(res)
+
+
+@blueprint.route('/metrics')
+def prometheus_metrics():
+    gauges = {}
+    for name, provider in stats_providers.items():
+        gauges.update(flatten_stats(provider(), name + '_'))
+    gauges.update(flatten_stats(all_pool_stats(), 'pool_'))
+    body = metrics.render(gauges) if metrics else ''
+    return current_app.response_class(
+        body, mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,93 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+from flask import current_app
+from .models import db, OutboundEmail
+
+SEND_TIMEOUT = 10
+
+_local = threading.local()
+_executor = None
+
+
+# one keep-alive session per sending thread
+def http_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+
+# long-lived so each sending thread keeps its pooled connections
+def executor(size):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(size)
+    return _executor
+
+
+def enqueue_email(recipient, subject, body):
+    email = OutboundEmail(recipient=recipient, subject=subject, body=body)
+    db.session.add(email)
+    return email
+
+
+def deliver(url, auth, sender, recipient, subject, body):
+    try:
+        response = http_session().post(url,
+                                       auth=auth,
+                                       data={
+                                           "from": sender,
+                                           "to": [recipient],
+                                           "subject": subject,
+                                           "text": body
+                                       },
+                                       timeout=SEND_TIMEOUT)
+        response.raise_for_status()
+    except Exception as err:
+        return str(err) or err.__class__.__name__
+    return None
+
+
+def retry_delay(attempts, base):
+    return timedelta(seconds=base * 2**(attempts - 1))
+
+
+# sends one batch of due emails; returns how many rows were processed
+def dispatch(batch_size=50):
+    config = current_app.config
+    now = datetime.utcnow()
+    batch = OutboundEmail.query.filter(
+        OutboundEmail.status == 'pending',
+        OutboundEmail.next_attempt_at <= now).order_by(
+            OutboundEmail.next_attempt_at).limit(batch_size).with_for_update(
+                skip_locked=True).all()
+    if not batch:
+        db.session.rollback()
+        return 0
+
+    url = config['MAILGUN_URL']
+    auth = ("api", config['EMAIL_API'])
+    sender = config['MAIL_FROM']
+    errors = list(
+        executor(config['MAIL_CONCURRENCY']).map(
+            lambda e: deliver(url, auth, sender, e[0], e[1], e[2]),
+            [(e.recipient, e.subject, e.body) for e in batch]))
+
+    for email, error in zip(batch, errors):
+        email.attempts += 1
+        if error is None:
+            email.status = 'sent'
+            email.sent_at = datetime.utcnow()
+            email.last_error = None
+        elif email.attempts >= config['MAIL_MAX_ATTEMPTS']:
+            email.status = 'dead'
+            email.last_error = error
+        else:
+            email.next_attempt_at = datetime.utcnow() + retry_delay(
+                email.attempts, config['MAIL_RETRY_BASE'])
+            email.last_error = error
+    db.session.commit()
+    return len(batch)
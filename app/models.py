@@ -1,11 +1,54 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask import g
 from flask_login import LoginManager, UserMixin
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import selectinload
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from collections import defaultdict
 from datetime import datetime
+from .cache import LRUCache
+from .config import Config
+from .geo import geohash_encode
+from .passwords import hash_password, verify_password, needs_rehash
+from .routing import RoutingSQLAlchemy
+from .serializers import Serializer
+import threading
 import uuid
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+
+# batched writes: callers stage rows and commit once per request
+class BulkMixin(object):
+    @classmethod
+    def bulk_add(cls, rows):
+        if rows:
+            db.session.bulk_insert_mappings(cls, rows)
+
+
+# association rows between an owner (event, user) and targets (category,
+# interest), named by owner_key / target_key
+class LinkMixin(BulkMixin):
+    owner_key = None
+    target_key = None
+
+    @classmethod
+    def link(cls, owner_id, target_ids, replace=False):
+        owner = getattr(cls, cls.owner_key)
+        target = getattr(cls, cls.target_key)
+        wanted = set(target_ids)
+        existing = {
+            t
+            for (t, ) in db.session.query(target).filter(owner == owner_id)
+        }
+        stale = existing - wanted
+        if replace and stale:
+            cls.query.filter(owner == owner_id, target.in_(stale)).delete(
+                synchronize_session=False)
+        cls.bulk_add([{
+            cls.owner_key: owner_id,
+            cls.target_key: t
+        } for t in wanted - existing])
 
 
 class User(UserMixin, db.Model):
@@ -14,7 +57,7 @@ class User(UserMixin, db.Model):
     name = db.Column(db.String, nullable=False)
     last_name = db.Column(db.String)
     description = db.Column(db.Text)
-    email = db.Column(db.String)
+    email = db.Column(db.String, index=True, unique=True)
     city = db.Column(db.String)
     country = db.Column(db.String)
     password = db.Column(db.String)
@@ -30,10 +73,16 @@ class User(UserMixin, db.Model):
                                   secondary='attendances')
 
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
 
+    # upgrades the stored hash when the configured algorithm or cost
+    # changed; the caller commits
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        if not verify_password(self.password, password):
+            return False
+        if needs_rehash(self.password):
+            self.password = hash_password(password)
+        return True
 
     def check_user(self):
         return User.query.filter_by(email=self.email).first()
@@ -42,29 +91,20 @@ class User(UserMixin, db.Model):
         db.session.add(self)
         db.session.commit()
 
-    def convert_to_obj(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "email": self.email,
-            "interests": [i.convert_to_obj() for i in self.interests],
-            "events": [i.event_info() for i in self.events],
-            "attendances": [i.event_info() for i in self.attendances],
-            "comments": [i.my_comments_info() for i in self.comments],
-            "country": self.country,
-            "city": self.city,
-        }
+    def convert_to_obj(self, profile='self', serializer=None):
+        return (serializer or Serializer()).user(self, profile)
 
 
 class Event(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (db.Index('ix_events_date_id', 'date', 'id'), )
     id = db.Column(db.Integer, primary_key=True)
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     title = db.Column(db.String, nullable=False)
     description = db.Column(db.Text)
     image_url = db.Column(db.String)
     address = db.Column(db.String)
-    city = db.Column(db.String)
+    city = db.Column(db.String, index=True)
     country = db.Column(db.String)
     time = db.Column(db.DateTime)
     date = db.Column(db.DateTime)
@@ -72,6 +112,23 @@ class Event(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     lat = db.Column(db.Float)
     lng = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
+    attendance_count = db.Column(db.Integer,
+                                 nullable=False,
+                                 default=0,
+                                 server_default='0')
+    comment_count = db.Column(db.Integer,
+                              nullable=False,
+                              default=0,
+                              server_default='0')
+    # row version for HTTP validators and cache keys; onupdate also fires
+    # for bump(), and the server default covers inserts from older code
+    updated_at = db.Column(db.DateTime,
+                           nullable=False,
+                           default=datetime.utcnow,
+                           onupdate=datetime.utcnow,
+                           server_default=db.text('CURRENT_TIMESTAMP'),
+                           index=True)
     categs = db.relationship('Category',
                              backref='event_categories',
                              lazy=True,
@@ -82,61 +139,116 @@ class Event(db.Model):
                                  secondary="attendances")
     comments = db.relationship('Comment', backref='event_comments', lazy=True)
 
+    scalar_fields = frozenset([
+        'id', 'creator_id', 'title', 'description', 'image_url', 'address',
+        'city', 'country', 'time', 'date', 'created_at', 'lat', 'lng',
+        'attendance_count', 'comment_count'
+    ])
+    summary_fields = frozenset(
+        ['id', 'creator_id', 'title', 'city', 'country', 'date', 'image_url'])
+
     def add(self):
         db.session.add(self)
         db.session.commit()
 
     def event_info(self):
-        return {
-            "id": self.id,
-            "creator_id": self.creator_id,
-            "title": self.title,
-            "city": self.city,
-            "country": self.country,
-            "date": self.date,
-            "image_url": self.image_url,
-        }
-
-    def convert_to_obj(self):
-        c = Comment.query.filter_by(event_id=self.id).all()
-        return {
-            "id":
-            self.id,
-            "title":
-            self.title,
-            'description':
-            self.description,
-            'image_url':
-            self.image_url,
-            'address':
-            self.address,
-            'city':
-            self.city,
-            'country':
-            self.country,
-            'time':
-            self.time,
-            'date':
-            self.date,
-            'created_at':
-            self.created_at,
-            'position': {
-                'lat': self.lat,
-                'lng': self.lng
-            },
-            'lat':
-            self.lat,
-            'lng':
-            self.lng,
-            "categories": [i.convert_to_obj() for i in self.categs],
-            "creator":
-            User.query.filter_by(id=self.creator_id).first().convert_to_obj(),
-            "attendants":
-            len(self.attendants),
-            "attendants_details":
-            [i.convert_to_obj() for i in self.attendants],
-            "comments": [i.convert_to_obj() for i in c],
-        }
+        return Serializer().event(self, 'summary')
+
+    # atomic in SQL, so concurrent joins and leaves never lose an update
+    @classmethod
+    def bump(cls, event_id, attendance=0, comments=0):
+        values = {}
+        if attendance:
+            values[cls.attendance_count] = cls.attendance_count + attendance
+        if comments:
+            values[cls.comment_count] = cls.comment_count + comments
+        cls.query.filter_by(id=event_id).update(values,
+                                                synchronize_session=False)
+        DataVersion.bump('events')
+
+    @classmethod
+    def with_details(cls):
+        return cls.query.options(*event_detail_options())
+
+    def project(self, fields, serializer=None):
+        obj = {f: getattr(self, f) for f in fields & self.scalar_fields}
+        if not fields <= self.scalar_fields:
+            detail = self.convert_to_obj(serializer)
+            obj.update({f: detail[f] for f in fields if f in detail})
+        return obj
+
+    def convert_to_obj(self, serializer=None):
+        return (serializer or Serializer()).event(self)
+
+    # the newest Config.EVENT_RECENT_COMMENTS comments, oldest first; load
+    # them for a whole page of events with load_latest_comments
+    @property
+    def latest_comments(self):
+        if '_latest_comments' not in self.__dict__:
+            Event.load_latest_comments([self])
+        return self._latest_comments
+
+    @classmethod
+    def load_latest_comments(cls, events, limit=None):
+        events = [e for e in events if '_latest_comments' not in e.__dict__]
+        if not events:
+            return
+        limit = limit or Config.EVENT_RECENT_COMMENTS
+        position = db.func.row_number().over(
+            partition_by=Comment.event_id,
+            order_by=(Comment.created_at.desc(),
+                      Comment.id.desc())).label('position')
+        ranked = db.session.query(Comment.id, position).filter(
+            Comment.event_id.in_([e.id for e in events])).subquery()
+        comments = Comment.query.join(ranked, ranked.c.id == Comment.id).filter(
+            ranked.c.position <= limit).options(
+                *comment_author_options()).order_by(Comment.created_at,
+                                                    Comment.id)
+        by_event = defaultdict(list)
+        for c in comments:
+            by_event[c.event_id].append(c)
+        for e in events:
+            e._latest_comments = by_event[e.id]
+
+
+@event.listens_for(Event, 'before_insert')
+@event.listens_for(Event, 'before_update')
+def set_event_geohash(mapper, connection, target):
+    if target.lat is None or target.lng is None:
+        target.geohash = None
+    else:
+        target.geohash = geohash_encode(target.lat, target.lng)
+
+
+# Counters moved inside the transactions that change what they version.
+# The row lock queues concurrent writers, so the values follow commit
+# order and a reader that sees a value also sees every write counted in
+# it; max(updated_at) is stamped at flush time and cannot promise that.
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name, connection=None):
+        statement = cls.__table__.update().where(cls.name == name).values(
+            value=cls.value + 1)
+        (connection or db.session).execute(statement)
+
+    @classmethod
+    def current(cls, name):
+        return db.session.query(cls.value).filter_by(name=name).scalar() or 0
+
+
+event.listen(
+    DataVersion.__table__, 'after_create',
+    DDL("INSERT INTO data_versions (name, value) VALUES ('events', 0)"))
+
+
+@event.listens_for(Event, 'before_insert')
+@event.listens_for(Event, 'before_update')
+def bump_event_list_version(mapper, connection, target):
+    DataVersion.bump('events', connection)
 
 
 class Category(db.Model):
@@ -157,33 +269,75 @@ class Interest(db.Model):
         return {"id": self.id, "name": self.name}
 
 
-class UserInterest(db.Model):
+class UserInterest(LinkMixin, db.Model):
     __tablename__ = 'userinterests'
+    owner_key = 'user_id'
+    target_key = 'interest_id'
+    __table_args__ = (db.Index('uq_userinterests_user_id_interest_id',
+                               'user_id',
+                               'interest_id',
+                               unique=True), )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     interest_id = db.Column(db.Integer, db.ForeignKey('interests.id'))
 
 
-class Attendance(db.Model):
+class Attendance(BulkMixin, db.Model):
     __tablename__ = 'attendances'
+    __table_args__ = (db.Index('uq_attendances_event_id_user_id',
+                               'event_id',
+                               'user_id',
+                               unique=True), )
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
 
     def add(self):
         db.session.add(self)
         db.session.commit()
 
-
-class EventCategory(db.Model):
+    # idempotent join/leave, one statement each; True when a row was
+    # actually inserted or deleted, so callers only bump counters then
+    @classmethod
+    def join(cls, event_id, user_id):
+        row = {'event_id': event_id, 'user_id': user_id}
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            stmt = postgresql.insert(cls.__table__).values(
+                row).on_conflict_do_nothing(
+                    index_elements=['event_id', 'user_id'])
+        elif dialect == 'sqlite':
+            stmt = cls.__table__.insert().prefix_with('OR IGNORE').values(row)
+        else:
+            if cls.query.filter_by(**row).first():
+                return False
+            stmt = cls.__table__.insert().values(row)
+        return db.session.execute(stmt).rowcount == 1
+
+    @classmethod
+    def leave(cls, event_id, user_id):
+        return cls.query.filter_by(event_id=event_id, user_id=user_id).delete(
+            synchronize_session=False) > 0
+
+
+class EventCategory(LinkMixin, db.Model):
     __tablename__ = 'eventcategories'
+    owner_key = 'event_id'
+    target_key = 'category_id'
+    __table_args__ = (db.Index('uq_eventcategories_event_id_category_id',
+                               'event_id',
+                               'category_id',
+                               unique=True), )
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'))
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
 
 
-class Comment(db.Model):
+class Comment(BulkMixin, db.Model):
     __tablename__ = 'comments'
+    # newest-first comment pages and per-event latest comments
+    __table_args__ = (db.Index('ix_comments_event_id_created_at_id',
+                               'event_id', 'created_at', 'id'), )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text, nullable=False)
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'))
@@ -205,15 +359,63 @@ class Comment(db.Model):
             'created_at': self.created_at,
         }
 
-    def convert_to_obj(self):
-        return {
-            "id": self.id,
-            "body": self.body,
-            'event_id': self.event_id,
-            'user':
-            User.query.filter_by(id=self.user_id).first().convert_to_obj(),
-            'created_at': self.created_at,
-        }
+    def convert_to_obj(self, serializer=None):
+        return (serializer or Serializer()).comment(self)
+
+
+# full-text GIN indexes behind app.search; the expressions must stay
+# identical to EVENT_DOCUMENT and COMMENT_DOCUMENT there. Migration
+# c58a3e17d924 adds them to existing databases, these to create_all.
+event.listen(
+    Event.__table__, 'after_create',
+    DDL("CREATE INDEX ix_events_search ON events USING gin "
+        "(to_tsvector('simple', coalesce(title, '') || ' ' || "
+        "coalesce(description, '')))").execute_if(dialect='postgresql'))
+event.listen(
+    Comment.__table__, 'after_create',
+    DDL("CREATE INDEX ix_comments_search ON comments USING gin "
+        "(to_tsvector('simple', body))").execute_if(dialect='postgresql'))
+
+
+# loads everything Event.convert_to_obj touches in a fixed number of
+# queries, whatever the number of events, attendants or comments
+def event_detail_options():
+    return [
+        selectinload(Event.categs),
+        selectinload(Event.user_events),
+        selectinload(Event.attendants),
+    ]
+
+
+def comment_author_options():
+    return [
+        selectinload(Comment.user_comments).load_only(
+            'id', 'name', 'city', 'country')
+    ]
+
+
+class GeocodeResult(db.Model):
+    __tablename__ = 'geocode_results'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String, unique=True, nullable=False)
+    result = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class OutboundEmail(db.Model):
+    __tablename__ = 'outbox'
+    __table_args__ = (db.Index('ix_outbox_status_next_attempt_at', 'status',
+                               'next_attempt_at'), )
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String, nullable=False)
+    subject = db.Column(db.String, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
 
 
 class OAuth(OAuthConsumerMixin, db.Model):
@@ -225,7 +427,10 @@ class OAuth(OAuthConsumerMixin, db.Model):
 class Token(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String, unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey(User.id),
+                        nullable=False,
+                        index=True)
     user = db.relationship(User, backref='token', lazy=True)
 
     def add(self):
@@ -245,12 +450,85 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 
+# token uuid -> detached User snapshot, merged into each request's session
+# without a query. Snapshots are only kept once share() has given the cache
+# a cross-worker broker (PUBSUB_URL): a logout then publishes the token and
+# every worker drops its copy. Without one a worker could keep serving a
+# revoked token until the TTL, so each request runs the joined query.
+class TokenCache(LRUCache):
+    channel = 'tokens:revoked'
+
+    def __init__(self, maxsize, ttl):
+        LRUCache.__init__(self, maxsize=maxsize, ttl=ttl)
+        self.broker = None
+        self._subscription = None
+        self._start_lock = threading.Lock()
+
+    def share(self, broker):
+        with self._start_lock:
+            if self._subscription is not None:
+                self.broker.unsubscribe(self._subscription)
+                self._subscription = None
+            self.broker = broker
+            self.clear()
+
+    # started lazily, after gunicorn has forked the worker
+    def listen(self):
+        with self._start_lock:
+            if self._subscription is None:
+                self._subscription = self.broker.subscribe(self.channel)
+                threading.Thread(target=self._drop_revoked,
+                                 args=(self._subscription, ),
+                                 name='token-revocations',
+                                 daemon=True).start()
+
+    def _drop_revoked(self, subscription):
+        while subscription is self._subscription:
+            api_key = subscription.get(60)
+            if subscription.overflowed:
+                # revocations were lost; no snapshot can be trusted
+                subscription.overflowed = False
+                self.clear()
+            elif api_key:
+                self.delete(api_key)
+
+    def revoke(self, api_key):
+        self.delete(api_key)
+        if self.broker is not None:
+            self.broker.publish(self.channel, api_key)
+
+
+token_cache = TokenCache(maxsize=Config.TOKEN_CACHE_SIZE,
+                         ttl=Config.TOKEN_CACHE_TTL)
+
+
+def user_for_token(api_key):
+    if token_cache.broker is None:
+        return User.query.join(Token, Token.user_id == User.id).filter(
+            Token.uuid == api_key).first()
+    token_cache.listen()
+    user = token_cache.get(api_key)
+    if user is None:
+        user = User.query.join(Token, Token.user_id == User.id).filter(
+            Token.uuid == api_key).first()
+        if user is None:
+            return None
+        db.session.expunge(user)
+        token_cache.set(api_key, user)
+    return db.session.merge(user, load=False)
+
+
+def forget_token(api_key):
+    token_cache.revoke(api_key)
+
+
 @login_manager.request_loader
 def load_user_from_request(request):
     api_key = request.headers.get('Authorization')
     if api_key:
         api_key = api_key.replace('Token ', '', 1)
-        token = Token.query.filter_by(uuid=api_key).first()
-        if token:
-            return token.user
+        user = user_for_token(api_key)
+        if user is not None:
+            g.api_token = api_key
+        return user
     return None
@@ -4,6 +4,7 @@ from flask_dance.contrib.facebook import make_facebook_blueprint
 from flask_dance.consumer import oauth_authorized, oauth_error
 from flask_dance.consumer.storage.sqla import SQLAlchemyStorage
 from sqlalchemy.orm.exc import NoResultFound
+from .instrumentation import log_event
 from .models import db, User, OAuth, Token
 import uuid, os
 
@@ -26,7 +27,7 @@ def facebook_logged_in(blueprint, token):
 
     info = resp.json()
     user_id = info["id"]
-    print(info)
+    log_event('facebook_login', provider_user_id=user_id)
 
     # Find this OAuth token in the database, or create it
     query = OAuth.query.filter_by(provider=blueprint.name,
@@ -40,7 +41,6 @@ def facebook_logged_in(blueprint, token):
 
     if oauth.user:
         login_user(oauth.user)
-        print(oauth.user)
         flash("Successfully signed in.")
 
     else:
@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def encode_cursor(value, id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, id = json.loads(raw)
+        if value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(id)
+    except (ValueError, TypeError):
+        return None
+
+
+# keyset pagination on (column, id), ascending unless descending is set;
+# rows with a NULL column come last either way
+def keyset(query, column, id_column, cursor, limit, descending=False):
+    if descending:
+        query = query.order_by(column.desc().nullslast(), id_column.desc())
+    else:
+        query = query.order_by(column.asc().nullslast(), id_column.asc())
+    if cursor:
+        value, id = cursor
+        after = id_column < id if descending else id_column > id
+        if value is None:
+            query = query.filter(column.is_(None), after)
+        else:
+            beyond = column < value if descending else column > value
+            query = query.filter(
+                or_(beyond, and_(column == value, after), column.is_(None)))
+    return query.limit(limit)
+
+
+def next_cursor(rows, column_name, limit):
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, column_name), last.id)
@@ -0,0 +1,105 @@
+import hashlib
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import check_password_hash, gen_salt, generate_password_hash
+
+SALT_LENGTH = 16
+
+_executor = None
+_slots = None
+_init_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    pass
+
+
+# the "method" part of a stored hash ("pbkdf2:sha256:260000",
+# "scrypt:32768:8:1") for the parameters currently configured
+def current_method(config):
+    if config['PASSWORD_HASH_METHOD'] == 'scrypt':
+        return 'scrypt:{}:{}:{}'.format(config['PASSWORD_SCRYPT_N'],
+                                        config['PASSWORD_SCRYPT_R'],
+                                        config['PASSWORD_SCRYPT_P'])
+    return '{}:{}'.format(config['PASSWORD_HASH_METHOD'],
+                          config['PASSWORD_HASH_ITERATIONS'])
+
+
+def scrypt_hex(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(),
+                          salt=salt.encode(),
+                          n=n,
+                          r=r,
+                          p=p,
+                          maxmem=256 * n * r * p).hex()
+
+
+# same "method$salt$hash" layout werkzeug uses, so newer werkzeug releases
+# can verify these hashes too
+def generate_hash(password, method):
+    if method.startswith('scrypt:'):
+        n, r, p = (int(v) for v in method.split(':')[1:])
+        salt = gen_salt(SALT_LENGTH)
+        return '{}${}${}'.format(method, salt, scrypt_hex(password, salt, n, r, p))
+    return generate_password_hash(password,
+                                  method=method,
+                                  salt_length=SALT_LENGTH)
+
+
+def check_hash(pwhash, password):
+    if not pwhash:
+        return False
+    if pwhash.startswith('scrypt:'):
+        try:
+            method, salt, expected = pwhash.split('$', 2)
+            n, r, p = (int(v) for v in method.split(':')[1:])
+        except ValueError:
+            return False
+        return hmac.compare_digest(scrypt_hex(password, salt, n, r, p),
+                                   expected)
+    return check_password_hash(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    method = (pwhash or '').split('$', 1)[0]
+    return method != current_method(current_app.config)
+
+
+# Hashing is deliberately slow; it runs on a small per-process pool so a
+# login burst takes at most PASSWORD_HASH_WORKERS cores. hashlib releases
+# the GIL, so threads hash in parallel. Every caller holds its request
+# thread until the hash is done, so only PASSWORD_HASH_WORKERS +
+# PASSWORD_HASH_QUEUE callers are admitted, fewer than there are request
+# threads; the rest get HashingBusy at once instead of piling up.
+def run_bounded(fn, *args):
+    global _executor, _slots
+    config = current_app.config
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                _slots = threading.BoundedSemaphore(
+                    config['PASSWORD_HASH_WORKERS'] +
+                    config['PASSWORD_HASH_QUEUE'])
+                _executor = ThreadPoolExecutor(
+                    config['PASSWORD_HASH_WORKERS'],
+                    thread_name_prefix='password-hash')
+    wait = config['PASSWORD_HASH_WAIT']
+    admitted = (_slots.acquire(timeout=wait)
+                if wait > 0 else _slots.acquire(blocking=False))
+    if not admitted:
+        raise HashingBusy()
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    return run_bounded(generate_hash, password,
+                       current_method(current_app.config))
+
+
+def verify_password(pwhash, password):
+    return run_bounded(check_hash, pwhash, password)
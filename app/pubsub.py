@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from .cache import redis_client
+from .instrumentation import log
+
+
+class Subscription(object):
+    def __init__(self, channel, maxsize):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize)
+        # set when messages were dropped; the client has to refetch
+        self.overflowed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# In-process fan-out: one bounded queue per subscriber, so a slow client
+# loses messages (and is told to resync) instead of growing memory or
+# blocking publishers. Messages are already-encoded strings, serialized
+# once per publish rather than once per subscriber.
+class LocalBroker(object):
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.published = 0
+        self.dropped = 0
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.queue_size)
+        with self._lock:
+            self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        self.published += 1
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+                self.dropped += 1
+
+    # the subscribers may have missed messages: each stream tells its
+    # client to refetch, without waiting for its next heartbeat
+    def resync(self):
+        with self._lock:
+            subscribers = [s for c in self._channels.values() for s in c]
+        for subscription in subscribers:
+            subscription.overflowed = True
+            try:
+                subscription.queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(len(s) for s in self._channels.values()),
+                'published': self.published,
+                'dropped': self.dropped,
+            }
+
+
+# Cross-worker variant: publishes go through Redis and a single listener
+# thread per process feeds the local subscribers, so every worker sees
+# every worker's messages. The listener reconnects with exponential
+# backoff; whatever was published meanwhile is lost, so its subscribers
+# are told to resync once it is back.
+class RedisBroker(LocalBroker):
+    def __init__(self,
+                 client,
+                 prefix='wetribe:pubsub:',
+                 queue_size=100,
+                 min_backoff=0.5,
+                 max_backoff=30.0):
+        LocalBroker.__init__(self, queue_size)
+        self.client = client
+        self.prefix = prefix
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        self._listener = None
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        return cls(redis_client(url, 'PUBSUB_URL'), **kwargs)
+
+    def subscribe(self, channel):
+        self.start()
+        return LocalBroker.subscribe(self, channel)
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, message)
+
+    # started lazily, after gunicorn has forked the worker
+    def start(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self.listen,
+                                                  name='pubsub-listener',
+                                                  daemon=True)
+                self._listener.start()
+
+    def listen(self):
+        delay = self.min_backoff
+        lost = False
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(self.prefix + '*')
+                if lost:
+                    self.reconnects += 1
+                    self.resync()
+                    lost = False
+                delay = self.min_backoff
+                for item in pubsub.listen():
+                    channel = item['channel']
+                    data = item['data']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    self.deliver(channel[len(self.prefix):], data)
+            except Exception:
+                log.warning("pubsub listener lost Redis, retrying in %.1fs",
+                            delay,
+                            exc_info=True)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            lost = True
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def stats(self):
+        row = LocalBroker.stats(self)
+        row['reconnects'] = self.reconnects
+        return row
+
+
+def make_broker(url=None, queue_size=100):
+    if url:
+        return RedisBroker.from_url(url, queue_size=queue_size)
+    return LocalBroker(queue_size=queue_size)
@@ -0,0 +1,163 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from flask import current_app, request
+from .cache import redis_client
+from .encoding import jsonify
+from .instrumentation import log
+
+# refill and spend atomically, so every worker shares one bucket per key
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+# "capacity/seconds": a burst of capacity requests, refilled evenly over
+# seconds; an empty value disables the rule
+@lru_cache(maxsize=None)
+def parse_rate(value):
+    if not value:
+        return None
+    capacity, seconds = value.split('/')
+    capacity = float(capacity)
+    return capacity, capacity / float(seconds)
+
+
+def retry_after(tokens, rate):
+    return max(1, int(math.ceil((1 - tokens) / rate)))
+
+
+class MemoryBuckets(object):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # evicting a bucket only ever refills it
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class RedisBuckets(object):
+    def __init__(self, client, prefix='wetribe:rl:'):
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    # fakeredis:// runs TAKE_SCRIPT in process (through lupa)
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        return cls(redis_client(url, 'RATELIMIT_URL'), **kwargs)
+
+    def take(self, key, capacity, rate):
+        allowed, tokens = self.script(keys=[self.prefix + key],
+                                      args=[capacity, rate, time.time()])
+        return bool(allowed), float(tokens)
+
+
+def make_buckets(url=None, maxsize=10000):
+    if url:
+        return RedisBuckets.from_url(url)
+    return MemoryBuckets(maxsize=maxsize)
+
+
+# Token buckets per client IP and per account. Rules are read per request
+# from RATELIMIT_<NAME>_IP and RATELIMIT_<NAME>_ACCOUNT, and several
+# endpoints can share a name so rotating between them buys nothing.
+class RateLimiter(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    def check(self, name, account=None):
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED']:
+            return None
+        prefix = 'RATELIMIT_' + name.upper()
+        checks = [('ip', request.remote_addr, config.get(prefix + '_IP'))]
+        if account:
+            checks.append(('account', account, config.get(prefix + '_ACCOUNT')))
+        for scope, value, rule in checks:
+            rate = parse_rate(rule)
+            if rate is None:
+                continue
+            capacity, per_second = rate
+            key = '{}:{}:{}'.format(name, scope, value)
+            try:
+                allowed, tokens = self.buckets.take(key, capacity, per_second)
+            except Exception:
+                # a broken shared backend must not lock everyone out
+                self.errors += 1
+                log.warning("rate limiter backend failed", exc_info=True)
+                return None
+            if not allowed:
+                self.limited += 1
+                return retry_after(tokens, per_second)
+        self.allowed += 1
+        return None
+
+    def limit(self, name, account=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                wait = self.check(name, account() if account else None)
+                if wait is not None:
+                    res = {
+                        'success': False,
+                        'message': 'Too many requests, please try again later'
+                    }
+                    response = jsonify(res)
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(wait)
+                    return response
+                return view(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        return {
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'errors': self.errors,
+        }
+
+
+def json_account(field):
+    def account():
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get(field), str):
+            return data[field].strip().lower() or None
+        return None
+
+    return account
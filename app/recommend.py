@@ -0,0 +1,212 @@
+import heapq
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from flask import current_app
+from .geo import haversine_km
+from .instrumentation import log
+from .models import db, Event, Attendance, EventCategory, Category
+
+INTEREST_WEIGHT = 3.0
+CITY_WEIGHT = 1.0
+DISTANCE_WEIGHT = 2.0
+DISTANCE_SCALE_KM = 10.0
+COATTENDANCE_WEIGHT = 1.0
+MAX_NEIGHBOURS = 500
+
+
+def normalize(name):
+    return (name or '').strip().lower()
+
+
+# In-memory inverted index: category name -> events, city -> events, and
+# the attendance graph in both directions. It is built on first use,
+# patched in place by this worker's writes and rebuilt once older than
+# max_age, so changes made through other workers show up within that
+# window. Rebuilds run in a background thread into a fresh index while
+# requests keep reading the old one; the patches made meanwhile are
+# replayed onto the new index before it is swapped in. Only a worker's
+# first request waits for a build.
+class RecommendationIndex(object):
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.built_at = None
+        self.rebuilds = 0
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self._building = False
+        self._pending = []
+        self._reset()
+
+    def _reset(self):
+        self.meta = {}
+        self.by_category = defaultdict(set)
+        self.by_city = defaultdict(set)
+        self.event_categories = defaultdict(set)
+        self.attendees = defaultdict(set)
+        self.user_events = defaultdict(set)
+
+    def ensure_fresh(self):
+        with self._lock:
+            start = not self._building and (
+                self.built_at is None
+                or time.monotonic() - self.built_at > self.max_age)
+            if start:
+                self._building = True
+                self._pending = []
+            first = self.built_at is None
+        if start and first:
+            self.rebuild()
+        elif start:
+            threading.Thread(target=self._rebuild_in,
+                             args=(current_app._get_current_object(), ),
+                             name='recommendation-rebuild',
+                             daemon=True).start()
+        self._ready.wait()
+
+    def _rebuild_in(self, app):
+        with app.app_context():
+            try:
+                self.rebuild()
+            except Exception:
+                log.warning("recommendation index rebuild failed",
+                            exc_info=True)
+            finally:
+                db.session.remove()
+
+    # reads everything into a new index without holding the lock, then
+    # swaps it in
+    def rebuild(self):
+        try:
+            fresh = RecommendationIndex(self.max_age)
+            fresh._load()
+            with self._lock:
+                for name, args in self._pending:
+                    getattr(fresh, name)(*args)
+                self.meta = fresh.meta
+                self.by_category = fresh.by_category
+                self.by_city = fresh.by_city
+                self.event_categories = fresh.event_categories
+                self.attendees = fresh.attendees
+                self.user_events = fresh.user_events
+                self.built_at = fresh.built_at
+                self.rebuilds += 1
+        finally:
+            with self._lock:
+                self._building = False
+                self._pending = []
+            self._ready.set()
+
+    def _load(self):
+        for row in db.session.query(Event.id, Event.date, Event.city,
+                                    Event.lat, Event.lng):
+            self._add_event(*row)
+        for event_id, name in db.session.query(
+                EventCategory.event_id,
+                Category.name).join(Category,
+                                    Category.id == EventCategory.category_id):
+            self._add_category(event_id, name)
+        for event_id, user_id in db.session.query(Attendance.event_id,
+                                                  Attendance.user_id):
+            self.attendees[event_id].add(user_id)
+            self.user_events[user_id].add(event_id)
+        self.built_at = time.monotonic()
+
+    # a change the running rebuild may have read too early
+    def _record(self, name, *args):
+        if self._building:
+            self._pending.append((name, args))
+
+    def _add_event(self, id, date, city, lat, lng):
+        self.meta[id] = (date, normalize(city), lat, lng)
+        if city:
+            self.by_city[normalize(city)].add(id)
+
+    def _add_category(self, event_id, name):
+        self.event_categories[event_id].add(normalize(name))
+        self.by_category[normalize(name)].add(event_id)
+
+    def _remove_event(self, id):
+        meta = self.meta.pop(id, None)
+        if meta:
+            self.by_city[meta[1]].discard(id)
+        for name in self.event_categories.pop(id, ()):
+            self.by_category[name].discard(id)
+
+    def refresh_event(self, event_id):
+        with self._lock:
+            self._record('refresh_event', event_id)
+            if self.built_at is None:
+                return
+            self._remove_event(event_id)
+            row = db.session.query(Event.id, Event.date, Event.city, Event.lat,
+                                   Event.lng).filter_by(id=event_id).first()
+            if row is None:
+                return
+            self._add_event(*row)
+            for (name, ) in db.session.query(Category.name).join(
+                    EventCategory,
+                    EventCategory.category_id == Category.id).filter(
+                        EventCategory.event_id == event_id):
+                self._add_category(event_id, name)
+
+    def on_join(self, event_id, user_id):
+        with self._lock:
+            self._record('on_join', event_id, user_id)
+            if self.built_at is not None:
+                self.attendees[event_id].add(user_id)
+                self.user_events[user_id].add(event_id)
+
+    def on_leave(self, event_id, user_id):
+        with self._lock:
+            self._record('on_leave', event_id, user_id)
+            if self.built_at is not None:
+                self.attendees[event_id].discard(user_id)
+                self.user_events[user_id].discard(event_id)
+
+    def recommend(self, user_id, interests, city, lat=None, lng=None,
+                  limit=20):
+        self.ensure_fresh()
+        with self._lock:
+            mine = self.user_events.get(user_id, set())
+            interests = {normalize(i) for i in interests}
+            city = normalize(city)
+
+            neighbours = Counter()
+            for event_id in mine:
+                neighbours.update(self.attendees.get(event_id, ()))
+            neighbours.pop(user_id, None)
+            co_attended = Counter()
+            for other, weight in neighbours.most_common(MAX_NEIGHBOURS):
+                for event_id in self.user_events.get(other, ()):
+                    co_attended[event_id] += weight
+
+            candidates = set(co_attended)
+            for name in interests:
+                candidates |= self.by_category.get(name, set())
+            if city:
+                candidates |= self.by_city.get(city, set())
+            candidates -= mine
+
+            now = datetime.utcnow()
+            scored = []
+            for event_id in candidates:
+                meta = self.meta.get(event_id)
+                if meta is None or meta[0] is None or meta[0] < now:
+                    continue
+                score = INTEREST_WEIGHT * len(
+                    interests & self.event_categories.get(event_id, set()))
+                if city and meta[1] == city:
+                    score += CITY_WEIGHT
+                if lat is not None and meta[2] is not None:
+                    distance = haversine_km(lat, lng, meta[2], meta[3])
+                    score += DISTANCE_WEIGHT / (1 + distance /
+                                                DISTANCE_SCALE_KM)
+                if event_id in co_attended:
+                    score += COATTENDANCE_WEIGHT * math.log1p(
+                        co_attended[event_id])
+                if score > 0:
+                    scored.append((score, event_id))
+            return heapq.nlargest(limit, scored, key=lambda s: (s[0], -s[1]))
@@ -0,0 +1,101 @@
+import random
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from .cache import RedisCache
+
+REPLICA_BIND_PREFIX = 'replica_'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replica_binds(urls):
+    urls = [url.strip() for url in (urls or '').split(',') if url.strip()]
+    return {REPLICA_BIND_PREFIX + str(i): url for i, url in enumerate(urls)}
+
+
+def use_primary():
+    if has_request_context():
+        g.db_route = 'primary'
+
+
+def reading_from_replica():
+    return has_request_context() and g.get('db_route') == 'replica'
+
+
+# sends queries to a replica while the request is routed there; anything
+# flushed switches the rest of the request back to the primary
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing:
+            use_primary()
+        elif reading_from_replica():
+            replicas = self.db.replica_keys(self.app)
+            if replicas:
+                return self.db.get_engine(self.app,
+                                          bind=random.choice(replicas))
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replica_keys(self, app=None):
+        binds = self.get_app(app).config.get('SQLALCHEMY_BINDS') or {}
+        return sorted(k for k in binds if k.startswith(REPLICA_BIND_PREFIX))
+
+    def replica_engines(self, app=None):
+        app = self.get_app(app)
+        return {
+            key: self.get_engine(app, bind=key)
+            for key in self.replica_keys(app)
+        }
+
+
+# GET-style requests read from a replica unless the caller wrote something
+# in the last sticky_seconds, so users always see their own writes. The
+# markers must reach every worker and must not be evicted by other
+# entries, so they live under their own prefix in the shared cache.
+class ReplicaRouter(object):
+    def __init__(self, db, current_user, sticky_seconds=10, store=None):
+        self.db = db
+        self.current_user = current_user
+        self.sticky_seconds = sticky_seconds
+        self.store = store
+
+    def init_app(self, app):
+        if self.store is None and self.db.replica_keys(app):
+            if not app.config.get('CACHE_URL'):
+                raise RuntimeError(
+                    "DATABASE_REPLICA_URLS needs CACHE_URL, so every worker "
+                    "sees which users have to read from the primary")
+            self.store = RedisCache.from_url(app.config['CACHE_URL'],
+                                             prefix='wetribe:sticky:')
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def sticky_key(self):
+        if self.current_user.is_authenticated:
+            return 'user:{}'.format(self.current_user.id)
+        return None
+
+    def before_request(self):
+        g.db_route = 'primary'
+        if request.method not in SAFE_METHODS or not self.db.replica_keys():
+            return
+        key = self.sticky_key()
+        if key and self.store.get(key):
+            return
+        g.db_route = 'replica'
+
+    def after_request(self, response):
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and self.db.replica_keys()):
+            key = self.sticky_key()
+            if key:
+                self.store.set(key, 1, ttl=self.sticky_seconds)
+        return response
@@ -0,0 +1,173 @@
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import func, literal_column, select, union
+from .models import db, Event, EventCategory, Comment
+
+TITLE_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+COMMENT_WEIGHT = 0.5
+MAX_CANDIDATES = 1000
+
+# must stay identical to the expressions indexed in the migration and in
+# app.models
+EVENT_DOCUMENT = literal_column(
+    "to_tsvector('simple', coalesce(events.title, '') || ' ' || "
+    "coalesce(events.description, ''))")
+COMMENT_DOCUMENT = literal_column("to_tsvector('simple', comments.body)")
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def apply_filters(query, city=None, category=None, date_from=None,
+                  date_to=None):
+    if city:
+        query = query.filter(Event.city == city)
+    if category:
+        query = query.filter(
+            Event.id.in_(
+                db.session.query(EventCategory.event_id).filter(
+                    EventCategory.category_id == category)))
+    if date_from:
+        query = query.filter(Event.date >= date_from)
+    if date_to:
+        query = query.filter(Event.date < date_to)
+    return query
+
+
+def postgres_search(terms, limit, **filters):
+    tsquery = func.to_tsquery('simple',
+                              ' & '.join(t + ':*' for t in terms))
+    comment_hits = select([
+        Comment.event_id,
+        func.max(func.ts_rank(COMMENT_DOCUMENT, tsquery)).label('rank')
+    ]).where(COMMENT_DOCUMENT.op('@@')(tsquery)).group_by(
+        Comment.event_id).alias('comment_hits')
+    # a union rather than an OR, so each side can use its own GIN index
+    matched = union(
+        select([Event.id]).where(EVENT_DOCUMENT.op('@@')(tsquery)),
+        select([Comment.event_id]).where(COMMENT_DOCUMENT.op('@@')(tsquery)))
+    rank = (func.ts_rank(EVENT_DOCUMENT, tsquery) +
+            COMMENT_WEIGHT * func.coalesce(comment_hits.c.rank, 0)).label('rank')
+    query = db.session.query(Event, rank).outerjoin(
+        comment_hits, comment_hits.c.event_id == Event.id).filter(
+            Event.id.in_(matched))
+    query = apply_filters(query, **filters)
+    return query.order_by(rank.desc(), Event.id).limit(limit).all()
+
+
+# Pure-Python fallback for databases without tsvector (SQLite in
+# development): term -> {event_id: weight}, with a sorted term list for
+# prefix lookups. Patched on writes in this worker, where a new term is
+# inserted in place rather than re-sorting the vocabulary; rebuilt after
+# max_age.
+class TextIndex(object):
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.built_at = None
+        self._lock = threading.RLock()
+
+    def ensure_fresh(self):
+        with self._lock:
+            if (self.built_at is None
+                    or time.monotonic() - self.built_at > self.max_age):
+                self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self.postings = defaultdict(lambda: defaultdict(float))
+            self.event_terms = defaultdict(set)
+            # sorted once at the end
+            self.terms = None
+            for id, title, description in db.session.query(
+                    Event.id, Event.title, Event.description):
+                self._add_event(id, title, description)
+            for event_id, body in db.session.query(Comment.event_id,
+                                                   Comment.body):
+                self._add(event_id, body, COMMENT_WEIGHT)
+            self.terms = sorted(self.postings)
+            self.built_at = time.monotonic()
+
+    def _add(self, event_id, text, weight):
+        for term in tokenize(text):
+            if self.terms is not None and term not in self.postings:
+                bisect.insort(self.terms, term)
+            self.postings[term][event_id] += weight
+            self.event_terms[event_id].add(term)
+
+    def _add_event(self, id, title, description):
+        self._add(id, title, TITLE_WEIGHT)
+        self._add(id, description, DESCRIPTION_WEIGHT)
+
+    def refresh_event(self, event_id):
+        with self._lock:
+            if self.built_at is None:
+                return
+            for term in self.event_terms.pop(event_id, ()):
+                self.postings[term].pop(event_id, None)
+            row = db.session.query(Event.title, Event.description).filter(
+                Event.id == event_id).first()
+            if row:
+                self._add_event(event_id, *row)
+            for (body, ) in db.session.query(
+                    Comment.body).filter(Comment.event_id == event_id):
+                self._add(event_id, body, COMMENT_WEIGHT)
+
+    def add_comment(self, event_id, body):
+        with self._lock:
+            if self.built_at is None:
+                return
+            self._add(event_id, body, COMMENT_WEIGHT)
+
+    def _prefix_scores(self, prefix, total):
+        scores = defaultdict(float)
+        i = bisect.bisect_left(self.terms, prefix)
+        while i < len(self.terms) and self.terms[i].startswith(prefix):
+            postings = self.postings[self.terms[i]]
+            if postings:
+                idf = math.log(1 + total / len(postings))
+                for event_id, weight in postings.items():
+                    scores[event_id] = max(scores[event_id], weight * idf)
+            i += 1
+        return scores
+
+    # every term must match as a prefix, like the Postgres 'a:* & b:*' query
+    def rank(self, terms):
+        self.ensure_fresh()
+        with self._lock:
+            total = max(len(self.event_terms), 1)
+            ranked = None
+            for term in terms:
+                scores = self._prefix_scores(term, total)
+                if ranked is None:
+                    ranked = scores
+                else:
+                    ranked = {
+                        id: ranked[id] + scores[id]
+                        for id in ranked if id in scores
+                    }
+                if not ranked:
+                    return []
+            return sorted(ranked.items(), key=lambda r: (-r[1], r[0]))
+
+
+def search_events(q, limit, index, **filters):
+    terms = tokenize(q)
+    if not terms:
+        return []
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgres_search(terms, limit, **filters)
+
+    ranked = index.rank(terms)[:MAX_CANDIDATES]
+    if not ranked:
+        return []
+    ranks = dict(ranked)
+    query = apply_filters(Event.query.filter(Event.id.in_(list(ranks))),
+                          **filters)
+    events = sorted(query, key=lambda e: (-ranks[e.id], e.id))
+    return [(e, ranks[e.id]) for e in events[:limit]]
@@ -0,0 +1,92 @@
+# Shape profiles for API payloads. Nested users are always rendered with
+# the 'summary' profile, so payload size stays linear in the number of
+# attendants and comments no matter how active those users are.
+
+USER_FIELDS = {
+    'id': lambda s, u: u.id,
+    'name': lambda s, u: u.name,
+    'email': lambda s, u: u.email,
+    'city': lambda s, u: u.city,
+    'country': lambda s, u: u.country,
+    'interests': lambda s, u: [i.convert_to_obj() for i in u.interests],
+    'events': lambda s, u: [s.event(e, 'summary') for e in u.events],
+    'attendances':
+    lambda s, u: [s.event(e, 'summary') for e in u.attendances],
+    'comments': lambda s, u: [c.my_comments_info() for c in u.comments],
+}
+
+USER_PROFILES = {
+    'summary': ('id', 'name', 'city', 'country'),
+    'detail': ('id', 'name', 'city', 'country', 'interests', 'events',
+               'attendances', 'comments'),
+    'self': ('id', 'name', 'email', 'city', 'country', 'interests', 'events',
+             'attendances', 'comments'),
+}
+
+EVENT_FIELDS = {
+    'id': lambda s, e: e.id,
+    'creator_id': lambda s, e: e.creator_id,
+    'title': lambda s, e: e.title,
+    'description': lambda s, e: e.description,
+    'image_url': lambda s, e: e.image_url,
+    'address': lambda s, e: e.address,
+    'city': lambda s, e: e.city,
+    'country': lambda s, e: e.country,
+    'time': lambda s, e: e.time,
+    'date': lambda s, e: e.date,
+    'created_at': lambda s, e: e.created_at,
+    'position': lambda s, e: {
+        'lat': e.lat,
+        'lng': e.lng
+    },
+    'lat': lambda s, e: e.lat,
+    'lng': lambda s, e: e.lng,
+    'categories': lambda s, e: [c.convert_to_obj() for c in e.categs],
+    'creator': lambda s, e: s.user(e.user_events),
+    'attendants': lambda s, e: e.attendance_count,
+    'attendants_details': lambda s, e: [s.user(u) for u in e.attendants],
+    'comments': lambda s, e: [s.comment(c) for c in e.latest_comments],
+    'comment_count': lambda s, e: e.comment_count,
+}
+
+EVENT_PROFILES = {
+    'summary': ('id', 'creator_id', 'title', 'city', 'country', 'date',
+                'image_url'),
+    'detail': ('id', 'title', 'description', 'image_url', 'address', 'city',
+               'country', 'time', 'date', 'created_at', 'position', 'lat',
+               'lng', 'categories', 'creator', 'attendants',
+               'attendants_details', 'comments', 'comment_count'),
+}
+
+
+# one instance per request: each (object, profile) is rendered once and the
+# same dict is reused wherever it appears again in the payload
+class Serializer(object):
+    def __init__(self):
+        self._memo = {}
+
+    def _render(self, kind, obj, fields, profile):
+        key = (kind, obj.id, profile)
+        rendered = self._memo.get(key)
+        if rendered is None:
+            rendered = {f: fields[f](self, obj) for f in profile}
+            self._memo[key] = rendered
+        return rendered
+
+    def user(self, user, profile='summary'):
+        if user is None:
+            return None
+        return self._render('user', user, USER_FIELDS, USER_PROFILES[profile])
+
+    def event(self, event, profile='detail'):
+        return self._render('event', event, EVENT_FIELDS,
+                            EVENT_PROFILES[profile])
+
+    def comment(self, comment):
+        return {
+            'id': comment.id,
+            'body': comment.body,
+            'event_id': comment.event_id,
+            'user': self.user(comment.user_comments),
+            'created_at': comment.created_at,
+        }
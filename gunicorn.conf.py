@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+
+# Threaded workers by default: /getpos, /getaddress and the outbound HTTP
+# clients spend most of their time waiting on Google Maps and Mailgun, and
+# a thread per in-flight request keeps the rest of the worker responsive.
+# Set GUNICORN_WORKER_CLASS=gevent (pip install -r requirements-gevent.txt)
+# for very high numbers of concurrent, mostly idle connections such as the
+# live event streams; `flask benchstreams` holds them against this config.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS") or "gthread"
+workers = int(
+    os.environ.get("WEB_CONCURRENCY") or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get("GUNICORN_THREADS") or 8)
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS") or 1000)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT") or 30)
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE") or 5)
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        # psycopg2 blocks the whole worker unless made cooperative
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def on_starting(server):
+    if workers > 1 and not (os.environ.get("PUBSUB_URL")
+                            or os.environ.get("CACHE_URL")):
+        # each worker only streams the updates it handled itself
+        server.log.warning(
+            "%s workers without PUBSUB_URL or CACHE_URL: live event streams "
+            "miss updates served by other workers", workers)
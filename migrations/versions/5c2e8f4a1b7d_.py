@@ -0,0 +1,38 @@
+"""add events.geohash
+
+Revision ID: 5c2e8f4a1b7d
+Revises: 1d7903bb7029
+Create Date: 2026-10-17 10:12:31.418206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.geo import geohash_encode
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f4a1b7d'
+down_revision = '1d7903bb7029'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('events', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index(op.f('ix_events_geohash'), 'events', ['geohash'], unique=False)
+
+    events = sa.table('events', sa.column('id', sa.Integer),
+                      sa.column('lat', sa.Float), sa.column('lng', sa.Float),
+                      sa.column('geohash', sa.String))
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select([events.c.id, events.c.lat, events.c.lng]).where(
+            sa.and_(events.c.lat.isnot(None), events.c.lng.isnot(None))))
+    for id, lat, lng in rows.fetchall():
+        conn.execute(events.update().where(events.c.id == id).values(
+            geohash=geohash_encode(lat, lng)))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_events_geohash'), table_name='events')
+    op.drop_column('events', 'geohash')
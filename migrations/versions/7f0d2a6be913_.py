@@ -0,0 +1,32 @@
+"""add events.attendance_count and events.comment_count
+
+Revision ID: 7f0d2a6be913
+Revises: e41b7c9d2f05
+Create Date: 2026-10-17 13:40:18.260947
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f0d2a6be913'
+down_revision = 'e41b7c9d2f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('events', sa.Column('attendance_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('events', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE events SET '
+        'attendance_count = (SELECT count(*) FROM attendances '
+        'WHERE attendances.event_id = events.id), '
+        'comment_count = (SELECT count(*) FROM comments '
+        'WHERE comments.event_id = events.id)')
+
+
+def downgrade():
+    op.drop_column('events', 'comment_count')
+    op.drop_column('events', 'attendance_count')
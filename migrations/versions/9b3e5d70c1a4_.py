@@ -0,0 +1,29 @@
+"""add data_versions
+
+Revision ID: 9b3e5d70c1a4
+Revises: f2a8d61c5e93
+Create Date: 2026-10-17 21:02:44.120573
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5d70c1a4'
+down_revision = 'f2a8d61c5e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_versions',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute("INSERT INTO data_versions (name, value) VALUES ('events', 0)")
+
+
+def downgrade():
+    op.drop_table('data_versions')
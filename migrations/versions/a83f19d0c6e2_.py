@@ -0,0 +1,31 @@
+"""add geocode_results
+
+Revision ID: a83f19d0c6e2
+Revises: 5c2e8f4a1b7d
+Create Date: 2026-10-17 11:02:47.093512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83f19d0c6e2'
+down_revision = '5c2e8f4a1b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('geocode_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('result', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('geocode_results')
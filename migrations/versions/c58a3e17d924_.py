@@ -0,0 +1,38 @@
+"""add full-text search indexes
+
+Revision ID: c58a3e17d924
+Revises: b6d9e0f37a41
+Create Date: 2026-10-17 16:12:08.417530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c58a3e17d924'
+down_revision = 'b6d9e0f37a41'
+branch_labels = None
+depends_on = None
+
+
+# expression indexes, kept identical to app.search.EVENT_DOCUMENT and
+# COMMENT_DOCUMENT so the planner can use them; other databases search
+# through the in-process fallback index instead
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(
+        "CREATE INDEX ix_events_search ON events USING gin "
+        "(to_tsvector('simple', coalesce(title, '') || ' ' || "
+        "coalesce(description, '')))")
+    op.execute(
+        "CREATE INDEX ix_comments_search ON comments USING gin "
+        "(to_tsvector('simple', body))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_comments_search', table_name='comments')
+    op.drop_index('ix_events_search', table_name='events')
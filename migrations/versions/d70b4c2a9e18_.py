@@ -0,0 +1,26 @@
+"""index comments for newest-first pages
+
+Revision ID: d70b4c2a9e18
+Revises: c58a3e17d924
+Create Date: 2026-10-17 17:03:51.208364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd70b4c2a9e18'
+down_revision = 'c58a3e17d924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_comments_event_id_created_at_id', 'comments', ['event_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_comments_event_id', table_name='comments')
+
+
+def downgrade():
+    op.create_index('ix_comments_event_id', 'comments', ['event_id'], unique=False)
+    op.drop_index('ix_comments_event_id_created_at_id', table_name='comments')
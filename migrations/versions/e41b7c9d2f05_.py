@@ -0,0 +1,72 @@
+"""add indexes and unique constraints on hot lookups
+
+Revision ID: e41b7c9d2f05
+Revises: a83f19d0c6e2
+Create Date: 2026-10-17 12:21:05.774390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b7c9d2f05'
+down_revision = 'a83f19d0c6e2'
+branch_labels = None
+depends_on = None
+
+
+def dedupe(table, *columns):
+    cols = ', '.join(columns)
+    op.execute(
+        sa.text('DELETE FROM {t} WHERE id NOT IN '
+                '(SELECT MIN(id) FROM {t} GROUP BY {c})'.format(t=table,
+                                                                c=cols)))
+
+
+# Accounts are referenced from every other table and an address cannot
+# be dropped without losing the login, so duplicates are not resolved
+# here: the upgrade stops and lists them, to be merged by hand first.
+def check_duplicate_emails():
+    duplicates = op.get_bind().execute(
+        sa.text('SELECT email, id FROM users WHERE email IN (SELECT email '
+                'FROM users WHERE email IS NOT NULL GROUP BY email '
+                'HAVING COUNT(*) > 1) ORDER BY email, id')).fetchall()
+    if duplicates:
+        ids = {}
+        for email, id in duplicates:
+            ids.setdefault(email, []).append(str(id))
+        raise RuntimeError(
+            'users.email must be unique; merge these accounts and run the '
+            'upgrade again:\n' + '\n'.join(
+                '  {}: users.id {}'.format(email, ', '.join(ids[email]))
+                for email in sorted(ids)))
+
+
+def upgrade():
+    check_duplicate_emails()
+    dedupe('attendances', 'event_id', 'user_id')
+    dedupe('eventcategories', 'event_id', 'category_id')
+    dedupe('userinterests', 'user_id', 'interest_id')
+
+    op.create_index('uq_attendances_event_id_user_id', 'attendances', ['event_id', 'user_id'], unique=True)
+    op.create_index(op.f('ix_attendances_user_id'), 'attendances', ['user_id'], unique=False)
+    op.create_index('uq_eventcategories_event_id_category_id', 'eventcategories', ['event_id', 'category_id'], unique=True)
+    op.create_index('uq_userinterests_user_id_interest_id', 'userinterests', ['user_id', 'interest_id'], unique=True)
+    op.create_index(op.f('ix_comments_event_id'), 'comments', ['event_id'], unique=False)
+    op.create_index(op.f('ix_events_city'), 'events', ['city'], unique=False)
+    op.create_index('ix_events_date_id', 'events', ['date', 'id'], unique=False)
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_token_user_id'), 'token', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_token_user_id'), table_name='token')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_index('ix_events_date_id', table_name='events')
+    op.drop_index(op.f('ix_events_city'), table_name='events')
+    op.drop_index(op.f('ix_comments_event_id'), table_name='comments')
+    op.drop_index('uq_userinterests_user_id_interest_id', table_name='userinterests')
+    op.drop_index('uq_eventcategories_event_id_category_id', table_name='eventcategories')
+    op.drop_index(op.f('ix_attendances_user_id'), table_name='attendances')
+    op.drop_index('uq_attendances_event_id_user_id', table_name='attendances')
@@ -0,0 +1,29 @@
+"""add events.updated_at
+
+Revision ID: f2a8d61c5e93
+Revises: d70b4c2a9e18
+Create Date: 2026-10-17 17:41:26.593018
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8d61c5e93'
+down_revision = 'd70b4c2a9e18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('events', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE events SET updated_at = coalesce(created_at, CURRENT_TIMESTAMP)")
+    # the running release does not set the column yet
+    op.alter_column('events', 'updated_at', existing_type=sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP'))
+    op.create_index(op.f('ix_events_updated_at'), 'events', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_events_updated_at'), table_name='events')
+    op.drop_column('events', 'updated_at')
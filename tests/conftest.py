@@ -0,0 +1,52 @@
+import os
+import tempfile
+import pytest
+
+# the app reads its configuration at import time
+DB_DIR = tempfile.mkdtemp(prefix='wetribe-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DB_DIR, 'test.db')
+os.environ['GOOGLE_KEY'] = 'AIza-test-key'
+for name in ('CACHE_URL', 'RATELIMIT_URL', 'PUBSUB_URL',
+             'DATABASE_REPLICA_URLS'):
+    os.environ.pop(name, None)
+
+from app import app as flask_app, response_cache, gmaps, search_index  # noqa: E402
+from app.bench import seed_data  # noqa: E402
+from app.models import db, token_cache, Event  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    flask_app.config['RATELIMIT_ENABLED'] = False
+    with flask_app.app_context():
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+    response_cache.backend.clear()
+    token_cache.clear()
+    gmaps.memory.clear()
+    # built from this test's rows; the next test starts with new ones
+    search_index.built_at = None
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# seed(events) inside an app context; returns every event id. Each call
+# gets its own seed, as seed_data's emails are only unique per seed.
+@pytest.fixture
+def seed(app):
+    calls = []
+
+    def seed(events, users=5, attendances=3, comments=3):
+        calls.append(events)
+        with app.app_context():
+            seed_data(users, events, attendances, comments, seed=len(calls))
+            return [id for (id, ) in db.session.query(Event.id)]
+
+    return seed
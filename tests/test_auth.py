@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+from app.bench import query_count
+from app.models import db, token_cache, User, Token
+from app.pubsub import LocalBroker, RedisBroker
+
+
+def make_user(app, token='token-1'):
+    with app.app_context():
+        user = User(name='Ann', email='ann@example.com', city='Berlin')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.flush()
+        if token:
+            db.session.add(Token(uuid=token, user_id=user.id))
+        db.session.commit()
+        return user.id
+
+
+def auth(token='token-1'):
+    return {'Authorization': 'Token ' + token}
+
+
+# without a shared broker nothing is cached: one joined query per request
+def test_getuser_with_token(app, client):
+    make_user(app)
+    for _ in range(2):
+        response = client.get('/getuser', headers=auth())
+        assert response.get_json()['token'] == 'token-1'
+        assert query_count(response) == 1
+    assert 'token-1' not in token_cache._data
+
+
+def test_token_deleted_by_another_worker_is_rejected(app, client):
+    make_user(app)
+    assert client.get('/getuser', headers=auth()).status_code == 200
+    # the logout ran elsewhere: this worker's snapshot is still cached
+    with app.app_context():
+        Token.query.filter_by(uuid='token-1').delete()
+        db.session.commit()
+    assert client.get('/getuser', headers=auth()).status_code == 401
+
+
+def test_logout_revokes_token(app, client):
+    make_user(app)
+    assert client.get('/logout', headers=auth()).status_code == 200
+    assert client.get('/getuser', headers=auth()).status_code == 401
+
+
+def test_getuser_without_token(app, client):
+    user_id = make_user(app, token=None)
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    response = client.get('/getuser')
+    assert response.status_code == 200
+    assert response.get_json()['token'] is None
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture(params=['local', 'redis'])
+def shared(request):
+    if request.param == 'local':
+        broker = LocalBroker()
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        broker = RedisBroker(fakeredis.FakeRedis(), min_backoff=0.01)
+    token_cache.share(broker)
+    yield broker
+    token_cache.share(None)
+
+
+# with a shared broker the warm path runs no query at all
+def test_shared_token_cache_skips_the_query(app, client, shared):
+    make_user(app)
+    assert query_count(client.get('/getuser', headers=auth())) == 1
+    response = client.get('/getuser', headers=auth())
+    assert response.get_json()['token'] == 'token-1'
+    assert query_count(response) == 0
+
+
+# a logout served by another worker reaches this worker's snapshot
+def test_revocation_reaches_every_worker(app, client, shared):
+    make_user(app)
+    assert client.get('/getuser', headers=auth()).status_code == 200
+    assert 'token-1' in token_cache._data
+    with app.app_context():
+        Token.query.filter_by(uuid='token-1').delete()
+        db.session.commit()
+    # the other worker's forget_token()
+    shared.publish(token_cache.channel, 'token-1')
+    wait_for(lambda: 'token-1' not in token_cache._data)
+    assert client.get('/getuser', headers=auth()).status_code == 401
+
+
+# revocations lost while the listener was away drop every snapshot
+def test_lost_revocations_clear_the_cache(app, client, shared):
+    make_user(app)
+    assert client.get('/getuser', headers=auth()).status_code == 200
+    shared.resync()
+    wait_for(lambda: not token_cache._data)
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import response_cache
+from app.cache import LRUCache, RedisCache, ResponseCache, redis_client
+from app.models import db, Event
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request):
+    if request.param == 'memory':
+        yield LRUCache(maxsize=4)
+    else:
+        cache = RedisCache(fakeredis.FakeRedis(), prefix='wetribe:test:')
+        yield cache
+        cache.clear()
+
+
+def test_get_set_incr_delete(backend):
+    assert backend.get('a') is None
+    assert backend.get('a', 'default') == 'default'
+    backend.set('a', 'body')
+    assert backend.get('a') == 'body'
+    assert backend.incr('n') == 1
+    assert backend.incr('n') == 2
+    backend.delete('a')
+    assert backend.get('a') is None
+
+
+def test_clear_only_drops_own_keys(backend):
+    backend.set('a', '1')
+    backend.clear()
+    assert backend.get('a') is None
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def bodies(request):
+    if request.param == 'memory':
+        yield LRUCache(maxsize=4)
+    else:
+        cache = RedisCache(fakeredis.FakeRedis(),
+                           prefix='wetribe:test:',
+                           decode=False)
+        yield cache
+        cache.clear()
+
+
+# a new version overwrites the variant's entry rather than adding one
+def test_new_version_replaces_the_old_body(bodies):
+    cache = ResponseCache(bodies)
+    key = cache.event_key(1)
+    cache.set(key, 'v1', '{"title": "old"}')
+    assert cache.get(key, 'v1') == '{"title": "old"}'
+    assert cache.get(key, 'v2') is None
+    cache.set(key, 'v2', '{"title": "new"}')
+    assert cache.get(key, 'v1') is None
+    assert cache.get(key, 'v2') == '{"title": "new"}'
+    if isinstance(bodies, LRUCache):
+        assert len(bodies) == 1
+    else:
+        assert len(list(bodies.client.scan_iter('wetribe:test:*'))) == 1
+
+
+def test_bodies_may_contain_newlines(bodies):
+    cache = ResponseCache(bodies)
+    cache.set(cache.list_key('limit=5'), 7, 'line one\nline two')
+    assert cache.get(cache.list_key('limit=5'), 7) == 'line one\nline two'
+
+
+def test_fake_url_shares_one_server():
+    first = RedisCache.from_url('fakeredis://')
+    second = RedisCache(redis_client('fakeredis://'), prefix='wetribe:')
+    first.set('shared', 'yes')
+    try:
+        assert second.get('shared') == 'yes'
+    finally:
+        first.delete('shared')
+
+
+# the app keeps one body per event however often the event changes, on
+# either backend
+@pytest.mark.parametrize('kind', ['memory', 'redis'])
+def test_edited_event_does_not_leave_old_bodies(app, client, seed,
+                                                monkeypatch, kind):
+    backend = (LRUCache(maxsize=64) if kind == 'memory' else RedisCache(
+        fakeredis.FakeRedis(), prefix='wetribe:test:', decode=False))
+    monkeypatch.setattr(response_cache, 'backend', backend)
+    id = seed(1)[0]
+    for n in range(5):
+        assert client.get('/geteventinfo/{}'.format(id)).status_code == 200
+        with app.app_context():
+            e = Event.query.get(id)
+            e.title = 'title {}'.format(n + 1)
+            e.updated_at = datetime.utcnow() + timedelta(seconds=n + 1)
+            db.session.commit()
+    response = client.get('/geteventinfo/{}'.format(id))
+    assert response.get_json()['event']['title'] == 'title 5'
+    if kind == 'memory':
+        assert len(backend) == 1
+    else:
+        keys = list(backend.client.scan_iter('wetribe:test:*'))
+        assert len(keys) == 1
+        backend.clear()
@@ -0,0 +1,89 @@
+from app.bench import query_count
+from app.models import db, Comment, DataVersion, Event, User
+
+
+def edit_elsewhere(app, event_id, title):
+    # a write served by another worker: nothing in this process hears of it
+    with app.app_context():
+        event = Event.query.get(event_id)
+        event.title = title
+        db.session.commit()
+
+
+def test_event_info_revalidates(app, client, seed):
+    event_id = seed(3)[0]
+    path = '/geteventinfo/{}'.format(event_id)
+    first = client.get(path)
+    etag = first.headers['ETag']
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+
+    edit_elsewhere(app, event_id, 'Renamed')
+    second = client.get(path, headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert second.get_json()['event']['title'] == 'Renamed'
+
+
+def test_event_list_follows_other_workers(app, client, seed):
+    event_id = seed(3)[0]
+    client.get('/geteventlist?limit=10')
+    edit_elsewhere(app, event_id, 'Renamed')
+    events = client.get('/geteventlist?limit=10').get_json()['events']
+    assert 'Renamed' in [e['title'] for e in events]
+
+
+def test_updated_at_defaults_in_the_database(app):
+    with app.app_context():
+        # an insert from code that does not know the column
+        db.session.execute("INSERT INTO events (title) VALUES ('Raw')")
+        db.session.commit()
+        assert Event.query.one().updated_at is not None
+
+
+def test_comment_pages_follow_other_workers(app, client, seed):
+    event_id = seed(1, comments=2)[0]
+    path = '/events/{}/comments'.format(event_id)
+    first = client.get(path)
+    assert len(first.get_json()['comments']) == 2
+    etag = first.headers['ETag']
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        user_id = db.session.query(User.id).first()[0]
+        db.session.add(Comment(event_id=event_id, user_id=user_id,
+                               body='Hello'))
+        Event.bump(event_id, comments=1)
+        db.session.commit()
+    second = client.get(path, headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.get_json()['comments'][0]['body'] == 'Hello'
+
+
+def test_comments_of_missing_event(app, client):
+    res = client.get('/events/42/comments').get_json()
+    assert res == {'success': False, 'message': 'Event not found'}
+
+
+def test_event_list_version_follows_commits(app, client, seed):
+    event_id = seed(3)[0]
+    etag = client.get('/geteventlist').headers['ETag']
+    revalidate = {'If-None-Match': etag}
+    response = client.get('/geteventlist', headers=revalidate)
+    assert response.status_code == 304
+    # one primary-key lookup, no count over the table
+    assert query_count(response) == 1
+    assert 'Last-Modified' not in response.headers
+
+    # another worker's transaction, still open
+    with app.app_context():
+        connection = db.engine.connect()
+    transaction = connection.begin()
+    connection.execute(Event.__table__.update().where(
+        Event.id == event_id).values(title='Renamed'))
+    DataVersion.bump('events', connection)
+    assert client.get('/geteventlist', headers=revalidate).status_code == 304
+    transaction.commit()
+    connection.close()
+    response = client.get('/geteventlist', headers=revalidate)
+    assert response.status_code == 200
+    assert 'Renamed' in [e['title'] for e in response.get_json()]
@@ -0,0 +1,68 @@
+import gzip
+import json
+import uuid
+from datetime import date, datetime
+
+from flask import json as flask_json
+
+from app.bench import query_count
+from app.encoding import dumps
+
+
+# the fast encoders keep Flask's wire format: HTTP dates, UUID strings
+def test_encoder_matches_flask_for_dates_and_uuids(app):
+    payload = {
+        'when': datetime(2030, 5, 1, 18, 30, 5),
+        'day': date(2030, 5, 1),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'title': 'Jazz picnic',
+    }
+    with app.app_context():
+        ours = json.loads(dumps(payload))
+        flask = json.loads(flask_json.dumps(payload))
+    assert ours == flask
+    assert ours['when'] == 'Wed, 01 May 2030 18:30:05 GMT'
+    assert ours['day'] == 'Wed, 01 May 2030 00:00:00 GMT'
+
+
+def get(client, path, accept=None):
+    headers = {'Accept-Encoding': accept} if accept else {}
+    return client.get(path, headers=headers)
+
+
+def test_gzip_is_negotiated(app, client, seed):
+    seed(10)
+    plain = get(client, '/geteventlist')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    for accept in ('gzip', 'gzip, deflate', 'br;q=1.0, gzip;q=0.8'):
+        response = get(client, '/geteventlist', accept)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data) == plain.data
+
+    refused = get(client, '/geteventlist', 'gzip;q=0, identity')
+    assert 'Content-Encoding' not in refused.headers
+    assert refused.data == plain.data
+
+
+def test_small_bodies_are_sent_as_they_are(app, client):
+    response = get(client, '/geteventinfo/424242', 'gzip')
+    assert 'Content-Encoding' not in response.headers
+
+
+# a cached body is compressed once per version, not on every hit
+def test_compressed_bodies_are_cached(app, client, seed, monkeypatch):
+    seed(10)
+    calls = []
+    compress = gzip.compress
+    monkeypatch.setattr('app.encoding.gzip.compress',
+                        lambda *a, **kw: calls.append(1) or compress(*a, **kw))
+    first = get(client, '/geteventlist?limit=5', 'gzip')
+    second = get(client, '/geteventlist?limit=5', 'gzip')
+    assert first.data == second.data
+    assert second.headers['Content-Encoding'] == 'gzip'
+    assert len(calls) == 1
+    # only the version lookup
+    assert query_count(second) == 1
@@ -0,0 +1,56 @@
+from app.geocoding import GeocodingCache, normalize_address
+from app.models import GeocodeResult
+
+RESULT = [{'geometry': {'location': {'lat': 52.52, 'lng': 13.4}}}]
+
+
+# stands in for googlemaps.Client and counts what would have been billed
+class StubClient(object):
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, address):
+        self.calls.append(('geocode', address))
+        return RESULT
+
+    def reverse_geocode(self, latlng):
+        self.calls.append(('reverse', latlng))
+        return [{'formatted_address': 'Berlin'}]
+
+
+def make_cache():
+    client = StubClient()
+    return GeocodingCache(lambda: client), client
+
+
+def test_normalize_address():
+    assert normalize_address('  Berlin ,Germany ') == 'berlin, germany'
+
+
+def test_repeated_address_is_fetched_once(app):
+    cache, client = make_cache()
+    with app.app_context():
+        assert cache.geocode('Berlin, Germany') == RESULT
+        assert cache.geocode(' berlin ,  GERMANY') == RESULT
+    assert client.calls == [('geocode', 'Berlin, Germany')]
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_database_tier_survives_a_restart(app):
+    first, client = make_cache()
+    with app.app_context():
+        first.geocode('Berlin, Germany')
+        assert GeocodeResult.query.count() == 1
+        # a fresh process: empty memory tier, same table
+        second, other = make_cache()
+        assert second.geocode('Berlin, Germany') == RESULT
+    assert other.calls == []
+    assert second.stats()['db_hits'] == 1
+
+
+def test_nearby_points_share_a_reverse_lookup(app):
+    cache, client = make_cache()
+    with app.app_context():
+        cache.reverse_geocode((52.520001, 13.400002))
+        cache.reverse_geocode((52.520004, 13.399998))
+    assert client.calls == [('reverse', (52.52, 13.4))]
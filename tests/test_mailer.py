@@ -0,0 +1,80 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+import pytest
+from app.mailer import dispatch, enqueue_email
+from app.models import db, OutboundEmail
+
+
+# a local stand-in for the Mailgun endpoint; answers every POST with
+# .status and records the form it received
+@pytest.fixture
+def mailgun(app):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers['Content-Length'])
+            server.received.append(parse_qs(self.rfile.read(length).decode()))
+            self.send_response(server.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.status = 200
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = app.config['MAILGUN_URL']
+    app.config['MAILGUN_URL'] = 'http://127.0.0.1:{}/messages'.format(
+        server.server_port)
+    yield server
+    app.config['MAILGUN_URL'] = url
+    server.shutdown()
+    server.server_close()
+
+
+def queue(app, count):
+    with app.app_context():
+        for i in range(count):
+            enqueue_email('user{}@example.com'.format(i), 'Hi', 'Hello')
+        db.session.commit()
+
+
+def test_dispatch_sends_pending(app, mailgun):
+    queue(app, 3)
+    with app.app_context():
+        assert dispatch() == 3
+        assert dispatch() == 0
+        emails = OutboundEmail.query.all()
+        assert {e.status for e in emails} == {'sent'}
+        assert all(e.sent_at and e.attempts == 1 for e in emails)
+    assert sorted(r['to'][0] for r in mailgun.received) == [
+        'user0@example.com', 'user1@example.com', 'user2@example.com'
+    ]
+
+
+def test_dispatch_retries_failures(app, mailgun):
+    mailgun.status = 500
+    queue(app, 1)
+    with app.app_context():
+        assert dispatch() == 1
+        email = OutboundEmail.query.one()
+        assert email.status == 'pending'
+        assert email.attempts == 1
+        assert '500' in email.last_error
+        # backed off, so not due again yet
+        assert dispatch() == 0
+
+
+def test_dispatch_gives_up(app, mailgun):
+    mailgun.status = 500
+    queue(app, 1)
+    with app.app_context():
+        email = OutboundEmail.query.one()
+        email.attempts = app.config['MAIL_MAX_ATTEMPTS'] - 1
+        db.session.commit()
+        dispatch()
+        email = OutboundEmail.query.one()
+        assert email.status == 'dead'
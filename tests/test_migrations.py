@@ -0,0 +1,57 @@
+import importlib.util
+import os
+
+import pytest
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+VERSIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations',
+                        'versions')
+
+
+def load(revision):
+    path = os.path.join(VERSIONS, revision + '_.py')
+    spec = importlib.util.spec_from_file_location(revision, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def users():
+    engine = sa.create_engine('sqlite://')
+    conn = engine.connect()
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)')
+    yield conn
+    conn.close()
+
+
+def check(conn):
+    migration = load('e41b7c9d2f05')
+    with Operations.context(MigrationContext.configure(conn)):
+        migration.check_duplicate_emails()
+
+
+# duplicate addresses stop the upgrade with the accounts to merge, and
+# nothing is changed
+def test_duplicate_emails_abort_the_upgrade(users):
+    users.execute("INSERT INTO users (id, email) VALUES (1, 'a@x.org'), "
+                  "(2, 'b@x.org'), (3, 'a@x.org'), (4, NULL), (5, NULL), "
+                  "(6, 'b@x.org'), (7, 'c@x.org')")
+    with pytest.raises(RuntimeError) as error:
+        check(users)
+    message = str(error.value)
+    assert 'a@x.org: users.id 1, 3' in message
+    assert 'b@x.org: users.id 2, 6' in message
+    assert 'c@x.org' not in message
+    rows = users.execute('SELECT id, email FROM users ORDER BY id').fetchall()
+    assert [email for _, email in rows] == [
+        'a@x.org', 'b@x.org', 'a@x.org', None, None, 'b@x.org', 'c@x.org'
+    ]
+
+
+def test_unique_emails_pass(users):
+    users.execute("INSERT INTO users (id, email) VALUES (1, 'a@x.org'), "
+                  "(2, NULL), (3, NULL)")
+    check(users)
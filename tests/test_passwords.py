@@ -0,0 +1,61 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app import passwords
+from app.models import db, User
+
+HASH_SECONDS = 0.5
+
+
+@pytest.fixture
+def slow_hashing(app, monkeypatch):
+    # one hashing thread and one queued caller, each hash taking a while
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_QUEUE', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WAIT', 0)
+    monkeypatch.setattr(passwords, '_executor', None)
+    monkeypatch.setattr(passwords, '_slots', None)
+    with app.app_context():
+        user = User(name='Ann', email='ann@example.com', city='Berlin')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+    check_hash = passwords.check_hash
+
+    def slow_check(pwhash, password):
+        time.sleep(HASH_SECONDS)
+        return check_hash(pwhash, password)
+
+    monkeypatch.setattr(passwords, 'check_hash', slow_check)
+
+
+def test_login_burst_is_refused_not_queued(app, slow_hashing):
+    started = threading.Barrier(7)
+
+    def login(_):
+        client = app.test_client()
+        started.wait()
+        start = time.perf_counter()
+        response = client.post('/login',
+                               json={
+                                   'email': 'ann@example.com',
+                                   'password': 'secret'
+                               })
+        return response.status_code, time.perf_counter() - start
+
+    with ThreadPoolExecutor(6) as pool:
+        logins = [pool.submit(login, i) for i in range(6)]
+        started.wait()
+        time.sleep(0.1)
+        # the hashing pool is full; a cheap endpoint still answers
+        start = time.perf_counter()
+        assert app.test_client().get('/geteventlist').status_code == 200
+        assert time.perf_counter() - start < HASH_SECONDS
+        results = [f.result() for f in logins]
+
+    statuses = sorted(status for status, _ in results)
+    assert statuses == [200, 200, 503, 503, 503, 503]
+    # refusals come back at once rather than after a wait
+    assert all(took < HASH_SECONDS for status, took in results
+               if status == 503)
@@ -0,0 +1,45 @@
+from app.bench import query_count
+from app import response_cache
+
+
+def queries(client, method, path, data=None):
+    # every body is built from scratch, not served from the cache
+    response_cache.backend.clear()
+    if method == 'GET':
+        response = client.get(path)
+    else:
+        response = client.post(path, json=data)
+    assert response.status_code == 200
+    return query_count(response)
+
+
+# the number of queries per request must not grow with the number of
+# events, attendees or comments returned
+def test_event_list_query_count_is_bounded(app, client, seed):
+    seed(5)
+    small = queries(client, 'GET', '/geteventlist')
+    seed(20)
+    assert queries(client, 'GET', '/geteventlist') == small
+
+
+def test_event_page_query_count_is_bounded(app, client, seed):
+    seed(5)
+    small = queries(client, 'GET', '/geteventlist?limit=50')
+    seed(20)
+    assert queries(client, 'GET', '/geteventlist?limit=50') == small
+
+
+def test_events_by_location_query_count_is_bounded(app, client, seed):
+    seed(15)
+    small = queries(client, 'POST', '/geteventsbylocation', 'Berlin, Germany')
+    assert small > 1
+    seed(40)
+    assert queries(client, 'POST', '/geteventsbylocation',
+                   'Berlin, Germany') == small
+
+
+def test_event_info_query_count_is_bounded(app, client, seed):
+    small_id = seed(1, attendances=1, comments=1)[0]
+    large_id = seed(1, users=20, attendances=20, comments=30)[-1]
+    assert queries(client, 'GET', '/geteventinfo/{}'.format(large_id)) == \
+        queries(client, 'GET', '/geteventinfo/{}'.format(small_id))
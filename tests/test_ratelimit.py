@@ -0,0 +1,87 @@
+import pytest
+
+from app import limiter
+from app.ratelimit import MemoryBuckets, RedisBuckets
+
+
+# ProxyFix trusts the Heroku router's X-Forwarded-For by default, so each
+# client is limited on its own address rather than the router's
+def test_clients_behind_the_router_get_their_own_bucket(app, client,
+                                                        monkeypatch):
+    monkeypatch.setitem(app.config, 'RATELIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_IP', '2/60')
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_ACCOUNT', '')
+
+    def login(ip):
+        return client.post('/login',
+                           json={'email': 'nobody@example.com'},
+                           headers={'X-Forwarded-For': ip},
+                           environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+    assert [login('1.1.1.1').status_code for _ in range(3)] == [200, 200, 429]
+    assert login('2.2.2.2').status_code == 200
+
+
+# the same rules through the in-process buckets and through TAKE_SCRIPT on
+# the fakeredis stand-in
+@pytest.fixture(params=['memory', 'redis'])
+def buckets(request, app, monkeypatch):
+    if request.param == 'memory':
+        buckets = MemoryBuckets()
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        buckets = RedisBuckets(
+            fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+    monkeypatch.setattr(limiter, 'buckets', buckets)
+    monkeypatch.setitem(app.config, 'RATELIMIT_ENABLED', True)
+    return buckets
+
+
+def login(client, email, ip='1.1.1.1'):
+    return client.post('/login',
+                       json={'email': email},
+                       headers={'X-Forwarded-For': ip})
+
+
+def test_limited_request_gets_429_with_retry_after(app, client, buckets,
+                                                   monkeypatch):
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_IP', '2/60')
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_ACCOUNT', '')
+    assert login(client, 'a@example.com').status_code == 200
+    assert login(client, 'b@example.com').status_code == 200
+    response = login(client, 'c@example.com')
+    assert response.status_code == 429
+    assert response.get_json()['success'] is False
+    # one token comes back every 30 seconds
+    assert 1 <= int(response.headers['Retry-After']) <= 30
+
+
+def test_each_account_has_its_own_bucket(app, client, buckets, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_IP', '100/60')
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_ACCOUNT', '2/60')
+    # rotating addresses does not help against one account ...
+    statuses = [
+        login(client, 'Victim@example.com ', ip).status_code
+        for ip in ('1.1.1.1', '2.2.2.2', '3.3.3.3')
+    ]
+    assert statuses == [200, 200, 429]
+    # ... and other accounts from the same address are unaffected
+    assert login(client, 'other@example.com', '3.3.3.3').status_code == 200
+
+
+def test_backend_errors_fail_open(app, client, buckets, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_IP', '1/60')
+    monkeypatch.setitem(app.config, 'RATELIMIT_AUTH_ACCOUNT', '1/60')
+    if isinstance(buckets, RedisBuckets):
+        pool = buckets.client.connection_pool
+        pool.connection_kwargs['server'].connected = False
+    else:
+        def broken(*args):
+            raise RuntimeError('backend down')
+
+        monkeypatch.setattr(buckets, 'take', broken)
+    errors = limiter.errors
+    statuses = [login(client, 'a@example.com').status_code for _ in range(3)]
+    assert statuses == [200, 200, 200]
+    assert limiter.errors == errors + 3
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from app.recommend import RecommendationIndex
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+# a stale index keeps answering while the new one is read in the
+# background, and writes made meanwhile survive the swap
+def test_stale_index_is_rebuilt_in_the_background(app, seed, monkeypatch):
+    event_id = seed(5)[0]
+    index = RecommendationIndex(max_age=0)
+    with app.app_context():
+        index.ensure_fresh()
+        assert index.rebuilds == 1
+
+        started, gate = threading.Event(), threading.Event()
+        load = RecommendationIndex._load
+
+        def slow_load(self):
+            started.set()
+            gate.wait(5)
+            load(self)
+
+        monkeypatch.setattr(RecommendationIndex, '_load', slow_load)
+        start = time.perf_counter()
+        index.recommend(1, ['music'], 'Berlin')
+        assert time.perf_counter() - start < 1
+        assert started.wait(5)
+        # only one rebuild at a time
+        index.recommend(1, ['music'], 'Berlin')
+
+        index.on_join(event_id, 999)
+        assert 999 in index.attendees[event_id]
+        gate.set()
+        wait_for(lambda: index.rebuilds == 2)
+        assert 999 in index.attendees[event_id]
+        assert event_id in index.user_events[999]
+        assert not index._building
+        time.sleep(0.1)
+        assert index.rebuilds == 2
+
+
+def test_first_build_is_synchronous(app, seed):
+    seed(3)
+    index = RecommendationIndex(max_age=300)
+    with app.app_context():
+        index.recommend(1, [], None)
+        assert index.rebuilds == 1
+        assert index.built_at is not None
+        assert len(index.meta) == 3
@@ -0,0 +1,34 @@
+from app.models import db, User
+
+SIGNUP = {
+    'name': 'Ann',
+    'lastname': 'Lee',
+    'email': 'ann@example.com',
+    'city': 'Berlin',
+    'country': 'Germany',
+    'password': 'secret',
+}
+
+
+def test_register_twice(app, client):
+    assert client.post('/register', json=SIGNUP).get_json()['success']
+    res = client.post('/register', json=SIGNUP).get_json()
+    assert res == {
+        'success': False,
+        'message': 'This email is already registered'
+    }
+
+
+def test_concurrent_register(app, client, monkeypatch):
+    add = User.add
+
+    def racing_add(user):
+        # the other submit commits between our lookup and our insert
+        db.engine.execute(User.__table__.insert(), name='Ann',
+                          email=user.email)
+        add(user)
+
+    monkeypatch.setattr(User, 'add', racing_add)
+    response = client.post('/register', json=SIGNUP)
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'This email is already registered'
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.local import LocalProxy
+from app.cache import LRUCache
+from app.routing import ReplicaRouter, RoutingSQLAlchemy, replica_binds
+
+
+def request_user():
+    user_id = request.headers.get('X-User')
+    return SimpleNamespace(is_authenticated=user_id is not None, id=user_id)
+
+
+# a primary and a replica that never catches up, so every read shows
+# which database it came from
+def make_app(tmp_path, store=None):
+    app = Flask('routing')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(tmp_path / 'p.db'),
+        SQLALCHEMY_BINDS=replica_binds('sqlite:///{}'.format(tmp_path /
+                                                             'r.db')),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db = RoutingSQLAlchemy(app)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    with app.app_context():
+        db.create_all()
+        Item.__table__.create(db.get_engine(app, bind='replica_0'))
+    ReplicaRouter(db, LocalProxy(request_user), store=store).init_app(app)
+
+    @app.route('/items', methods=['GET', 'POST'])
+    def items():
+        if request.method == 'POST':
+            db.session.add(Item())
+            db.session.commit()
+        return jsonify(len(Item.query.all()))
+
+    return app
+
+
+def test_reads_go_to_replica_until_the_user_writes(tmp_path):
+    client = make_app(tmp_path, store=LRUCache()).test_client()
+    assert client.get('/items', headers={'X-User': '1'}).get_json() == 0
+    assert client.post('/items', headers={'X-User': '1'}).get_json() == 1
+    # the writer reads its own write from the primary, others do not
+    assert client.get('/items', headers={'X-User': '1'}).get_json() == 1
+    assert client.get('/items', headers={'X-User': '2'}).get_json() == 0
+    assert client.get('/items').get_json() == 0
+
+
+def test_replicas_need_a_shared_store(tmp_path):
+    with pytest.raises(RuntimeError):
+        make_app(tmp_path)
@@ -0,0 +1,102 @@
+import pytest
+
+from app.models import db, Attendance, Event, User, Token
+
+HEADERS = {'Authorization': 'Token rsvp-token'}
+
+
+@pytest.fixture
+def user(app):
+    with app.app_context():
+        user = User(name='Ann', email='ann@example.com', city='Berlin')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Token(uuid='rsvp-token', user_id=user.id))
+        db.session.commit()
+        return user.id
+
+
+def rsvp(client, *entries):
+    return client.post('/rsvp', json={'rsvps': list(entries)},
+                       headers=HEADERS).get_json()
+
+
+# (attendance_count, attendance rows) per event, which must never drift
+def counts(app, *event_ids):
+    with app.app_context():
+        return [(Event.query.get(id).attendance_count,
+                 Attendance.query.filter_by(event_id=id).count())
+                for id in event_ids]
+
+
+def test_join_is_idempotent(app, client, seed, user):
+    event_id = seed(1, attendances=0)[0]
+    for _ in range(3):
+        res = client.post('/joinevent', json=event_id,
+                          headers=HEADERS).get_json()
+        assert res == {'joined': True, 'attendance': 1}
+    assert counts(app, event_id) == [(1, 1)]
+
+
+def test_leaving_an_event_never_joined(app, client, seed, user):
+    event_id = seed(1, attendances=0)[0]
+    res = client.post('/leaveevent', json=event_id, headers=HEADERS)
+    assert res.get_json() == {'joined': False}
+    assert counts(app, event_id) == [(0, 0)]
+    res = rsvp(client, {'event_id': event_id, 'attending': False})
+    assert res['results'] == [{
+        'event_id': event_id,
+        'attending': False,
+        'changed': False,
+        'attendance': 0
+    }]
+
+
+@pytest.mark.parametrize('attending', ['false', 'true', 0, 1, None, []])
+def test_attending_must_be_a_boolean(app, client, seed, user, attending):
+    event_id = seed(1, attendances=0)[0]
+    res = rsvp(client, {'event_id': event_id, 'attending': attending})
+    assert res == {'success': False, 'message': 'Invalid rsvp entry'}
+    res = rsvp(client, {'event_id': event_id})
+    assert res == {'success': False, 'message': 'Invalid rsvp entry'}
+    assert counts(app, event_id) == [(0, 0)]
+
+
+def test_last_entry_wins(app, client, seed, user):
+    first, second = seed(2, attendances=0)
+    res = rsvp(client, {'event_id': first, 'attending': True},
+               {'event_id': second, 'attending': True},
+               {'event_id': first, 'attending': False})
+    assert {r['event_id']: r['attending'] for r in res['results']} == {
+        first: False,
+        second: True
+    }
+    assert counts(app, first, second) == [(0, 0), (1, 1)]
+
+
+def test_unknown_events_are_reported(app, client, seed, user):
+    event_id = seed(1, attendances=0)[0]
+    res = rsvp(client, {'event_id': event_id, 'attending': True},
+               {'event_id': 424242, 'attending': True})
+    assert res['success']
+    assert [r['event_id'] for r in res['results']] == [event_id]
+    assert res['unknown'] == [424242]
+
+
+# a client resending the same batch after a dropped response changes
+# nothing the second time
+def test_repeated_batches_do_not_drift(app, client, seed, user):
+    ids = seed(4, attendances=0)
+    batch = [{'event_id': id, 'attending': i % 2 == 0}
+             for i, id in enumerate(ids)]
+    first = rsvp(client, *batch)
+    assert [r['changed'] for r in first['results']] == [True, False, True,
+                                                       False]
+    for _ in range(3):
+        again = rsvp(client, *batch)
+        assert not any(r['changed'] for r in again['results'])
+    flipped = rsvp(client, *[dict(b, attending=not b['attending'])
+                             for b in batch])
+    assert all(r['changed'] for r in flipped['results'])
+    assert counts(app, *ids) == [(0, 0), (1, 1), (0, 0), (1, 1)]
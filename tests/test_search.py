@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import search_index
+from app.models import db, Event, Category, EventCategory
+
+
+@pytest.fixture
+def events(app):
+    with app.app_context():
+        music, outdoors = Category(name='music'), Category(name='outdoors')
+        db.session.add_all([music, outdoors])
+        rows = [
+            ('Jazz picnic', 'by the river', 'Berlin',
+             datetime(2030, 5, 1, 18), music),
+            ('Jazz concert', 'late night', 'Paris', datetime(2030, 6, 1),
+             music),
+            ('Morning hike', 'jazzy tunes on the way', 'Berlin',
+             datetime(2030, 5, 10), outdoors),
+        ]
+        ids = []
+        for title, description, city, date, category in rows:
+            e = Event(title=title, description=description, city=city,
+                      date=date)
+            db.session.add(e)
+            db.session.flush()
+            db.session.add(EventCategory(event_id=e.id,
+                                         category_id=category.id))
+            ids.append(e.id)
+        db.session.commit()
+        return ids, {'music': music.id, 'outdoors': outdoors.id}
+
+
+def found(client, query):
+    res = client.get('/search?' + query).get_json()
+    assert res['success']
+    return [e['id'] for e in res['events']]
+
+
+def test_terms_match_as_prefixes(client, events):
+    (picnic, concert, hike), _ = events
+    # titles outrank descriptions; ties go to the older event
+    assert found(client, 'q=jaz') == [picnic, concert, hike]
+    assert found(client, 'q=hik') == [hike]
+    assert found(client, 'q=xylophone') == []
+
+
+def test_every_term_must_match(client, events):
+    (picnic, concert, hike), _ = events
+    assert found(client, 'q=jazz+picnic') == [picnic]
+    assert found(client, 'q=jazz+river') == [picnic]
+    assert found(client, 'q=jaz+morn') == [hike]
+    assert found(client, 'q=jazz+xylophone') == []
+
+
+def test_city_and_category_filters(client, events):
+    (picnic, concert, hike), categories = events
+    assert sorted(found(client, 'q=jaz&city=Berlin')) == sorted(
+        [picnic, hike])
+    assert sorted(found(client, 'q=jaz&category={}'.format(
+        categories['music']))) == sorted([picnic, concert])
+    assert found(
+        client, 'q=jaz&city=Berlin&category={}'.format(
+            categories['outdoors'])) == [hike]
+
+
+def test_date_filters(client, events):
+    (picnic, concert, hike), _ = events
+    assert sorted(found(client, 'q=jaz&from=2030-05-01&to=2030-05-31')) == \
+        sorted([picnic, hike])
+    # 'to' includes the whole day
+    assert found(client, 'q=jaz&to=2030-05-01') == [picnic]
+    assert found(client, 'q=jaz&from=2030-05-02&to=2030-05-31') == [hike]
+    res = client.get('/search?q=jaz&from=May').get_json()
+    assert res == {'success': False, 'message': 'Invalid search filters'}
+
+
+def test_writes_keep_the_vocabulary_sorted(app, client, events):
+    (picnic, concert, hike), _ = events
+    assert found(client, 'q=saxo') == []
+    with app.app_context():
+        search_index.add_comment(concert, 'Bring a saxophone and an apple')
+    assert found(client, 'q=saxo') == [concert]
+    assert found(client, 'q=appl') == [concert]
+    assert search_index.terms == sorted(search_index.postings)
+
+
+def create_all_ddl(dialect):
+    statements = []
+
+    def executor(sql, *multiparams, **params):
+        statements.append(str(sql.compile(dialect=engine.dialect)))
+
+    engine = create_engine(dialect + '://', strategy='mock', executor=executor)
+    db.metadata.create_all(engine, checkfirst=False)
+    return '\n'.join(statements)
+
+
+# createdb builds the GIN indexes on Postgres and skips them elsewhere
+def test_create_all_builds_search_indexes_on_postgres():
+    ddl = create_all_ddl('postgresql')
+    assert 'CREATE INDEX ix_events_search ON events USING gin' in ddl
+    assert 'CREATE INDEX ix_comments_search ON comments USING gin' in ddl
+    assert 'ix_events_search' not in create_all_ddl('sqlite')
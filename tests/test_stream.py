@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from app import app as flask_app, broker
+from app.bench import bench_gevent_streams
+from app.pubsub import RedisBroker
+
+
+def open_stream(client, event_id):
+    return client.get('/events/{}/stream'.format(event_id), buffered=False)
+
+
+def test_stream_starts_with_a_snapshot(app, client, seed):
+    event_id = seed(1)[0]
+    response = open_stream(client, event_id)
+    first = next(response.response)
+    assert first.startswith(b'retry: ')
+    assert b'"type":"snapshot"' in first
+    assert broker.stats()['subscribers'] == 1
+    response.close()
+    assert broker.stats()['subscribers'] == 0
+
+
+def test_streams_per_worker_are_capped(app, client, seed):
+    event_id = seed(1)[0]
+    limit = flask_app.config['SSE_MAX_STREAMS']
+    streams = [open_stream(client, event_id) for _ in range(limit)]
+    assert {s.status_code for s in streams} == {200}
+
+    refused = open_stream(client, event_id)
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After']
+
+    # a stream closed before its first byte gives its slot back too
+    streams.pop().close()
+    streams.append(open_stream(client, event_id))
+    assert streams[-1].status_code == 200
+    for stream in streams:
+        stream.close()
+
+
+def test_missing_event_releases_its_slot(app, client):
+    for _ in range(flask_app.config['SSE_MAX_STREAMS'] + 1):
+        res = open_stream(client, 42).get_json()
+        assert res['message'] == 'Event not found'
+
+
+# a fakeredis client whose first `failures` pubsub connections drop
+class FlakyClient(object):
+    def __init__(self, failures):
+        import fakeredis
+        self.client = fakeredis.FakeRedis()
+        self.failures = failures
+
+    def publish(self, channel, message):
+        return self.client.publish(channel, message)
+
+    def pubsub(self, **kwargs):
+        pubsub = self.client.pubsub(**kwargs)
+        if self.failures:
+            self.failures -= 1
+
+            def listen():
+                raise ConnectionError('Connection reset by peer')
+                yield
+
+            pubsub.listen = listen
+        return pubsub
+
+
+def test_redis_listener_reconnects_and_resyncs():
+    pytest.importorskip('fakeredis')
+    redis_broker = RedisBroker(FlakyClient(failures=2),
+                               min_backoff=0.01,
+                               max_backoff=0.05)
+    stale = redis_broker.subscribe('event:1')
+    # the stream wakes up to send its resync instead of a heartbeat
+    assert stale.get(5) is None
+    assert stale.overflowed
+    assert redis_broker.stats()['reconnects'] == 1
+
+    fresh = redis_broker.subscribe('event:1')
+    deadline = time.monotonic() + 5
+    message = None
+    while message is None and time.monotonic() < deadline:
+        redis_broker.publish('event:1', '{"type":"comment"}')
+        message = fresh.get(0.1)
+    assert message == '{"type":"comment"}'
+
+
+# N idle streams held against a real gunicorn gevent worker; every one of
+# them keeps getting heartbeats and a cheap endpoint stays responsive
+def test_gevent_worker_holds_idle_streams(app, seed):
+    for module in ('gunicorn', 'gevent', 'psycogreen'):
+        pytest.importorskip(module)
+    event_id = seed(1)[0]
+    with app.app_context():
+        row = bench_gevent_streams(event_id, 200, heartbeat=0.5, probes=10)
+    assert row['streams'] == 200
+    assert row['refused'] == 0
+    assert row['heartbeats'] == 200
+    assert row['p95_ms'] < 500